@@ -10,9 +10,15 @@ from .streams import ColorLevelFormatter, SplitStreamHandler, ColorStreamHandler
 
 __all__ = ['setup_logging', 'captureWarnings', 'ColorLevelFormatter', 'SplitStreamHandler', 'ColorStreamHandler']
 
-def setup_logging(mode='stream', increment=False, level=logging.NOTSET, warnings=True, filenames=None):
-    """A quick way to set up logging for a particular logger."""
+def setup_logging(mode='stream', increment=False, level=logging.NOTSET, warnings=True, filenames=None, watchdog=None):
+    """A quick way to set up logging for a particular logger.
+    
+    Pass ``warnings="aggregate"`` to count repeated warnings and log
+    periodic summaries, rather than logging every warning. Pass
+    ``watchdog`` (in seconds) to move handlers which get slower than
+    that per record onto a background queue.
+    """
     logging.addLevelName(5, "MSG")
-    configure(mode, disable_existing_loggers = not increment, filenames = filenames)
+    configure(mode, disable_existing_loggers = not increment, filenames = filenames, watchdog = watchdog)
     logging.getLogger().setLevel(level)
-    captureWarnings(warnings)
+    captureWarnings(bool(warnings), aggregate=(warnings == "aggregate"))
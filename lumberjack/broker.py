@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+A forwarding broker for ZMQ log streams.
+
+Publishers connect to the broker's frontend, and listeners connect to its
+backend, so that many publishers on a host can share one well-known
+address, and listeners only need to know the broker's address.
+"""
+
+from __future__ import print_function, absolute_import
+
+import sys
+import time
+import logging
+import threading
+
+try:
+    import zmq
+except ImportError as e:
+    print("The python bindings for ZMQ are required to use lumberjack.broker\nPlease install pyzmq.", file=sys.stderr)
+
+__all__ = ['Broker']
+
+class Broker(object):
+    """An XSUB/XPUB forwarding device for ZMQ log streams.
+    
+    Subscriptions from listeners are forwarded upstream, so that topic
+    filtering still happens at the publishers. Messages are forwarded as
+    zero-copy frames.
+    
+    By default, a listener which falls behind loses the messages past its
+    own high-water mark, and other listeners are unaffected. ZMQ discards
+    these silently, so they are not counted.
+    
+    With ``nodrop=True``, the backend refuses messages which would exceed
+    a listener's high-water mark, so that they are counted in ``dropped``.
+    **This degrades every listener to the slowest one**: while any one
+    listener's queue is full, messages are refused for all listeners.
+    Use it only to measure loss with a single listener.
+    """
+    
+    def __init__(self, frontend="tcp://*:6998", backend="tcp://*:6999", context=None, nodrop=False):
+        super(Broker, self).__init__()
+        self.ctx = context or zmq.Context.instance()
+        self.frontend = self.ctx.socket(zmq.XSUB)
+        self.frontend.bind(frontend)
+        self.backend = self.ctx.socket(zmq.XPUB)
+        if nodrop:
+            self.backend.setsockopt(zmq.XPUB_NODROP, 1)
+        self.backend.bind(backend)
+        self.nodrop = nodrop
+        
+        self.forwarded = 0
+        self.dropped = 0
+        self.subscriptions = 0
+        
+        self._shouldrun = threading.Event()
+        self._poller = zmq.Poller()
+        self._poller.register(self.frontend, zmq.POLLIN)
+        self._poller.register(self.backend, zmq.POLLIN)
+        
+    @property
+    def counters(self):
+        """Counters for messages forwarded and dropped, and subscriptions
+        forwarded. Drops are only counted with ``nodrop=True``."""
+        return {'forwarded' : self.forwarded, 'dropped' : self.dropped, 'subscriptions' : self.subscriptions}
+        
+    def _forward_messages(self):
+        """Forward all waiting messages from publishers to listeners."""
+        while True:
+            try:
+                frames = self.frontend.recv_multipart(zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                return
+            try:
+                self.backend.send_multipart(frames, zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                self.dropped += 1
+            else:
+                self.forwarded += 1
+        
+    def _forward_subscriptions(self):
+        """Forward all waiting subscriptions from listeners to publishers."""
+        while True:
+            try:
+                frames = self.backend.recv_multipart(zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                return
+            self.frontend.send_multipart(frames, copy=False)
+            self.subscriptions += 1
+        
+    def stop(self):
+        """Stop the broker."""
+        self._shouldrun.clear()
+        
+    def run(self, interval=10.0):
+        """Run the broker, logging counters every ``interval`` seconds."""
+        logger = logging.getLogger(__name__)
+        reported = time.time()
+        self._shouldrun.set()
+        while self._shouldrun.isSet():
+            ready = dict(self._poller.poll(timeout=100))
+            if self.backend in ready:
+                self._forward_subscriptions()
+            if self.frontend in ready:
+                self._forward_messages()
+            if interval and time.time() - reported >= interval:
+                reported = time.time()
+                if self.nodrop:
+                    logger.info("Forwarded {forwarded:d} messages, dropped {dropped:d}, {subscriptions:d} subscriptions.".format(**self.counters))
+                else:
+                    logger.info("Forwarded {forwarded:d} messages, {subscriptions:d} subscriptions.".format(**self.counters))
+        
+    def close(self):
+        """Close the broker's sockets."""
+        self.frontend.close()
+        self.backend.close()
+    
+
+def main(*args):
+    """Main function for argument parsing and running the broker."""
+    import argparse
+    from . import setup_logging
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--frontend", type=str, help="Address for publishers to connect to.", default="tcp://*:6998")
+    parser.add_argument("-b", "--backend", type=str, help="Address for listeners to connect to.", default="tcp://*:6999")
+    parser.add_argument("-i", "--interval", type=float, help="Seconds between counter reports.", default=10.0)
+    parser.add_argument("--nodrop", action='store_true', help="Count dropped messages. Every listener is slowed to the slowest one.")
+    opt = parser.parse_args(args or None)
+    setup_logging('stream', level=logging.INFO)
+    broker = Broker(opt.frontend, opt.backend, nodrop=opt.nodrop)
+    print("Forwarding log messages from {0} to {1}".format(opt.frontend, opt.backend))
+    try:
+        broker.run(opt.interval)
+    except KeyboardInterrupt:
+        print("...ending")
+    finally:
+        broker.close()
+    return 0
+    
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Buffer records until something goes wrong, then send the whole story.
+"""
+
+import copy
+import logging
+import threading
+import collections
+import contextlib
+
+try:
+    import contextvars
+except ImportError: # pragma: no cover
+    contextvars = None
+
+__all__ = ['FingersCrossedHandler']
+
+class FingersCrossedHandler(logging.Handler, object):
+    """A handler which holds records back until one reaches ``trigger``.
+    
+    Records below ``trigger`` are kept in a bounded buffer of the most
+    recent ``capacity`` records, and go nowhere while all is well. When a
+    record at or above ``trigger`` arrives, the buffer and that record are
+    sent to the ``target`` handler as one batch (with
+    :meth:`~lumberjack.publisher.Publisher.handle_batch`, where the target
+    has it), and the buffer is emptied.
+    
+    Each :meth:`context` (e.g. one per request) has its own buffer, which
+    is discarded when the context ends. Outside of a context, each thread
+    has its own buffer. Contexts follow ``contextvars`` where it is
+    available, so they work with asyncio tasks as well as threads.
+    
+    Buffered records are rendered when they are buffered, so they don't
+    keep their arguments or tracebacks alive, and don't change if their
+    arguments do.
+    """
+    
+    def __init__(self, target, trigger=logging.ERROR, capacity=1000):
+        super(FingersCrossedHandler, self).__init__()
+        self.target = target
+        self.trigger = trigger
+        self.capacity = capacity
+        self.triggered = 0
+        self._local = threading.local()
+        if contextvars is not None:
+            self._context = contextvars.ContextVar("lumberjack_buffer_{0:x}".format(id(self)), default=None)
+        else:
+            self._context = None
+    
+    def _buffer(self):
+        """The buffer for the current context, or thread."""
+        if self._context is not None:
+            buffer = self._context.get()
+        else:
+            buffer = getattr(self._local, 'context', None)
+        if buffer is None:
+            buffer = getattr(self._local, 'buffer', None)
+            if buffer is None:
+                buffer = self._local.buffer = collections.deque(maxlen=self.capacity)
+        return buffer
+    
+    @contextlib.contextmanager
+    def context(self):
+        """Buffer records in a fresh buffer until the context ends.
+    
+        Records which were never triggered are discarded.
+        """
+        buffer = collections.deque(maxlen=self.capacity)
+        if self._context is not None:
+            token = self._context.set(buffer)
+            try:
+                yield buffer
+            finally:
+                self._context.reset(token)
+        else:
+            previous = getattr(self._local, 'context', None)
+            self._local.context = buffer
+            try:
+                yield buffer
+            finally:
+                self._local.context = previous
+    
+    def _snapshot(self, record):
+        """Copy a record with its message and traceback rendered, so it can be held."""
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+    
+    def handle(self, record):
+        """Filter a record, and emit it. The buffers are per-context, so
+        the handler lock is not needed."""
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+    
+    def emit(self, record):
+        """Buffer a record, or send the buffer if the record triggers it."""
+        try:
+            buffer = self._buffer()
+            if record.levelno < self.trigger:
+                buffer.append(self._snapshot(record))
+                return
+            records = list(buffer)
+            buffer.clear()
+            records.append(record)
+            self.triggered += 1
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+            return
+        handle_batch = getattr(self.target, 'handle_batch', None)
+        if handle_batch is not None:
+            handle_batch(records)
+        else:
+            for item in records:
+                self.target.handle(item)
+    
+    def clear(self):
+        """Discard the buffer for the current context, or thread."""
+        self._buffer().clear()
+    
+    def flush(self):
+        """Flush the target handler."""
+        self.target.flush()
+    
+    def close(self):
+        """Close the target handler."""
+        self.target.close()
+        super(FingersCrossedHandler, self).close()
+    
+    
\ No newline at end of file
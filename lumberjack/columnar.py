@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Column-oriented collection of log records, for bulk analysis with NumPy.
+
+Numeric fields are stored as NumPy arrays, and string fields are
+dictionary-encoded as integer codes into a vocabulary array.
+"""
+
+from __future__ import print_function, absolute_import
+
+import os
+import sys
+import array
+import logging
+
+try:
+    import numpy as np
+except ImportError as e:
+    print("NumPy is required to use lumberjack.columnar\nPlease install numpy.", file=sys.stderr)
+
+__all__ = ['ColumnarSink', 'load', 'level_histogram', 'logger_counts', 'time_buckets']
+
+#: Numeric columns, and their array typecodes.
+NUMERIC = (('created', 'd'), ('levelno', 'l'), ('lineno', 'l'), ('process', 'l'))
+
+#: Dictionary-encoded string columns.
+ENCODED = ('name', 'pathname', 'funcName')
+
+def _vocabulary_key(field):
+    """The key under which a column's vocabulary is saved."""
+    return "{0}_vocabulary".format(field)
+
+class ColumnarSink(logging.Handler, object):
+    """A handler which collects records into column-oriented batches.
+    
+    Records are appended to compact typed buffers, which are sealed into
+    NumPy arrays every ``batch_size`` records. Attach the sink to the
+    logger that a watcher dispatches to, then :meth:`save` the columns.
+    Missing numeric values are stored as -1.
+    """
+    
+    def __init__(self, batch_size=65536):
+        super(ColumnarSink, self).__init__()
+        self.batch_size = batch_size
+        self.vocabularies = dict((field, {}) for field in ENCODED)
+        self.batches = []
+        self._buffers = self._new_buffers()
+        
+    def _new_buffers(self):
+        """Make empty buffers for a batch."""
+        buffers = dict((field, array.array(typecode)) for field, typecode in NUMERIC)
+        buffers.update((field, array.array('l')) for field in ENCODED)
+        return buffers
+        
+    def __len__(self):
+        return sum(len(batch['created']) for batch in self.batches) + len(self._buffers['created'])
+        
+    def emit(self, record):
+        """Append a record to the current batch.
+        
+        Every value is converted before any is appended, so a bad value
+        can't leave the columns with different lengths.
+        """
+        try:
+            row = {}
+            for field, typecode in NUMERIC:
+                value = getattr(record, field, None)
+                row[field] = array.array(typecode, [-1 if value is None else value])
+            for field in ENCODED:
+                value = getattr(record, field, None) or ""
+                vocabulary = self.vocabularies[field]
+                code = vocabulary.get(value)
+                if code is None:
+                    code = vocabulary[value] = len(vocabulary)
+                row[field] = array.array('l', [code])
+            buffers = self._buffers
+            for field, value in row.items():
+                buffers[field].extend(value)
+            if len(buffers['created']) >= self.batch_size:
+                self._seal()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+        
+    def _seal(self):
+        """Seal the current buffers into a batch of arrays."""
+        if len(self._buffers['created']):
+            self.batches.append(dict((field, np.array(buffer)) for field, buffer in self._buffers.items()))
+            self._buffers = self._new_buffers()
+        
+    def columns(self):
+        """All columns collected so far, as a dictionary of arrays, including
+        the vocabulary for each encoded column."""
+        self.acquire()
+        try:
+            self._seal()
+            columns = {}
+            for field, typecode in NUMERIC:
+                columns[field] = np.concatenate([batch[field] for batch in self.batches]) if self.batches else np.zeros(0, dtype=typecode)
+            for field in ENCODED:
+                columns[field] = np.concatenate([batch[field] for batch in self.batches]) if self.batches else np.zeros(0, dtype='l')
+                vocabulary = sorted(self.vocabularies[field], key=self.vocabularies[field].get)
+                columns[_vocabulary_key(field)] = np.array(vocabulary, dtype=np.str_)
+        finally:
+            self.release()
+        return columns
+        
+    def save(self, path):
+        """Save the columns, either to a ``.npz`` file, or (for any other
+        path) to a directory of memory-mappable ``.npy`` files."""
+        columns = self.columns()
+        if path.endswith(".npz"):
+            np.savez(path, **columns)
+            return
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for key, column in columns.items():
+            np.save(os.path.join(path, key + ".npy"), column)
+    
+
+def load(path, mmap=True):
+    """Load columns saved by :meth:`ColumnarSink.save`.
+    
+    Directories of ``.npy`` files are memory-mapped when ``mmap`` is set.
+    """
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            return dict((key, data[key]) for key in data.files)
+    columns = {}
+    for filename in os.listdir(path):
+        key, ext = os.path.splitext(filename)
+        if ext == ".npy":
+            columns[key] = np.load(os.path.join(path, filename), mmap_mode='r' if mmap else None)
+    return columns
+    
+def level_histogram(columns):
+    """Count records by level number, as a dictionary."""
+    levels, counts = np.unique(columns['levelno'], return_counts=True)
+    return dict(zip(levels.tolist(), counts.tolist()))
+    
+def logger_counts(columns, field='name'):
+    """Count records by an encoded column (by default, logger name),
+    most frequent first, as a list of (value, count) pairs."""
+    vocabulary = columns[_vocabulary_key(field)]
+    counts = np.bincount(columns[field], minlength=len(vocabulary))
+    order = np.argsort(counts)[::-1]
+    return [(vocabulary.item(i), int(counts[i])) for i in order if counts[i]]
+    
+def time_buckets(columns, width=60.0):
+    """Count records in time buckets ``width`` seconds wide. Returns the
+    start time of each non-empty bucket, and the count in each bucket."""
+    buckets = np.floor(np.asarray(columns['created']) / width).astype(np.int64)
+    starts, counts = np.unique(buckets, return_counts=True)
+    return starts * width, counts
+    
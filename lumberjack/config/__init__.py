@@ -28,7 +28,17 @@ def _get_configbuffer(mode, cfg=None, filenames=None):
     cfgbuffer.seek(0)
     return cfgbuffer
 
-def configure(mode, disable_existing_loggers=False, cfg=None, filenames=None):
-    """Configure from predefined useful default modes."""
+def configure(mode, disable_existing_loggers=False, cfg=None, filenames=None, watchdog=None):
+    """Configure from predefined useful default modes.
+    
+    If ``watchdog`` is given, each root handler is wrapped in a
+    :class:`~lumberjack.watchdog.WatchdogHandler`, which moves it to a
+    background queue while it takes longer than ``watchdog`` seconds per
+    record.
+    """
     cfgbuffer = _get_configbuffer(mode, cfg=cfg, filenames=filenames)
-    return logging.config.fileConfig(cfgbuffer, disable_existing_loggers=disable_existing_loggers)
\ No newline at end of file
+    result = logging.config.fileConfig(cfgbuffer, disable_existing_loggers=disable_existing_loggers)
+    if watchdog:
+        from ..watchdog import install
+        install(threshold=watchdog)
+    return result
\ No newline at end of file
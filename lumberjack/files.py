@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+File output, written in segments which are rotated by size or time and
+compressed in the background.
+"""
+
+import io
+import os
+import time
+import gzip
+import shutil
+import logging
+import threading
+
+from six.moves import queue
+
+from .serialize import serializers, SerializingFormatter
+from .replay import CaptureWriter
+
+__all__ = ['SegmentFileHandler']
+
+class SegmentFileHandler(logging.Handler, object):
+    """A handler which writes records to a file in segments.
+    
+    Records are written through a userspace buffer of ``buffersize`` bytes,
+    so most records cost no system call. The active segment is ``filename``.
+    It is rotated once it holds ``maxbytes`` bytes, or once ``interval``
+    seconds have passed since it was opened. Closed segments are renamed
+    with a timestamp (``app.log`` becomes ``app.20160101-120000.log``) and,
+    if ``compress`` is set, gzipped on a background thread.
+    
+    With a ``serializer`` (one of :data:`~lumberjack.serialize.serializers`),
+    segments are capture files, which ``lumberjack-listen file://...`` and
+    ``lumberjack-replay`` read back. Otherwise, each record is written as a
+    line of text by the handler's formatter.
+    """
+    
+    def __init__(self, filename, serializer=None, maxbytes=64 * 1024 * 1024, interval=None,
+                 buffersize=1024 * 1024, compress=True):
+        super(SegmentFileHandler, self).__init__()
+        if serializer is not None:
+            if serializer not in serializers:
+                raise ValueError("Unknown serializer {0!r}".format(serializer))
+            self.setFormatter(serializers[serializer]())
+        self.filename = os.path.abspath(filename)
+        self.serializer = serializer
+        self.maxbytes = maxbytes
+        self.interval = interval
+        self.buffersize = buffersize
+        self.compress = compress
+        self.segments = 0
+        self._writer = None
+        self._size = 0
+        self._rollover_at = None
+        self._queue = queue.Queue()
+        self._compressor = None
+    
+    def _open(self):
+        """Open the active segment."""
+        if self.serializer is not None:
+            # A capture file can't be appended to, and each segment must be
+            # readable on its own, so stateful encodings start from scratch.
+            if os.path.exists(self.filename) and os.path.getsize(self.filename):
+                self._rotate_file()
+            if isinstance(self.formatter, SerializingFormatter):
+                if self.formatter.strings is not None:
+                    self.formatter.strings.reset()
+                self.formatter.reset_tracebacks()
+        fileobj = io.open(self.filename, 'ab', buffering=self.buffersize)
+        if self.serializer is not None:
+            self._writer = CaptureWriter(fileobj, self.serializer)
+        else:
+            self._writer = fileobj
+        self._size = fileobj.tell()
+        if self.interval:
+            self._rollover_at = time.time() + self.interval
+    
+    def _segment_name(self):
+        """Name a closed segment by the current time."""
+        base, ext = os.path.splitext(self.filename)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        name = "{0}.{1}{2}".format(base, stamp, ext)
+        n = 0
+        while os.path.exists(name) or os.path.exists(name + ".gz"):
+            n += 1
+            name = "{0}.{1}-{2:d}{3}".format(base, stamp, n, ext)
+        return name
+    
+    def _rotate_file(self):
+        """Move the active segment aside, and queue it for compression."""
+        name = self._segment_name()
+        os.rename(self.filename, name)
+        self.segments += 1
+        if self.compress:
+            if self._compressor is None:
+                self._compressor = threading.Thread(target=self._compress_segments, name="SegmentCompressor")
+                self._compressor.daemon = True
+                self._compressor.start()
+            self._queue.put(name)
+    
+    def _compress_segments(self):
+        """Compress closed segments in the background. A segment which
+        can't be compressed is left as it is, and a warning is logged."""
+        while True:
+            name = self._queue.get()
+            if name is None:
+                return
+            temporary = name + ".gz.tmp"
+            try:
+                with io.open(name, 'rb') as src, gzip.open(temporary, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                shutil.copystat(name, temporary)
+                os.rename(temporary, name + ".gz")
+                os.remove(name)
+            except (IOError, OSError):
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+                logging.getLogger(__name__).warning("Can't compress log segment {0}".format(name), exc_info=True)
+    
+    def rotate(self):
+        """Close the active segment, and start a new one."""
+        self.acquire()
+        try:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+                self._rotate_file()
+        finally:
+            self.release()
+    
+    def should_rotate(self, record):
+        """Whether the active segment is full, or old enough to rotate."""
+        if self._size >= self.maxbytes:
+            return True
+        return self._rollover_at is not None and record.created >= self._rollover_at
+    
+    def emit(self, record):
+        """Write a single record to the active segment."""
+        try:
+            if self._writer is not None and self.should_rotate(record):
+                self._writer.close()
+                self._writer = None
+                self._rotate_file()
+            if self._writer is None:
+                self._open()
+            if self.serializer is not None:
+                self._size += self._writer.write(record.created, self.format(record))
+            else:
+                self._size += self._writer.write((self.format(record) + "\n").encode('utf-8'))
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+    
+    def flush(self):
+        """Flush the userspace buffer to the active segment."""
+        self.acquire()
+        try:
+            if self._writer is not None:
+                self._writer.flush()
+        finally:
+            self.release()
+    
+    def close(self):
+        """Close the active segment, and wait for queued compression to finish.
+    
+        The active segment is left in place, uncompressed.
+        """
+        self.acquire()
+        try:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        finally:
+            self.release()
+        if self._compressor is not None:
+            self._queue.put(None)
+            self._compressor.join()
+            self._compressor = None
+        super(SegmentFileHandler, self).close()
+    
+    
\ No newline at end of file
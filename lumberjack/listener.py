@@ -13,26 +13,93 @@ import sys
 import select
 import string
 import time
+import functools
 
 from six.moves.urllib.parse import urlparse as _urlparse, parse_qs
 
 from .utils import ttyraw
 from .streams import SplitStreamHandler, ColorLevelFormatter, ColorStreamHandler
 from .filters import Filter
+from .stats import StreamStats
+from .watcher import MergeStage
+
+class FrameRenderer(logging.Handler, object):
+    """A handler which queues records, and renders them to a target
+    handler at a fixed frame rate.
+    
+    At most ``limit`` records are rendered per frame. Past that, only the
+    most recent records are rendered, after a summary line of the form
+    "N records/s, M elided". Memory use is bounded by ``limit``.
+    """
+    
+    def __init__(self, target, fps=10.0, limit=50):
+        super(FrameRenderer, self).__init__()
+        self.target = target
+        self.fps = fps
+        self.limit = limit
+        self._queue = collections.deque(maxlen=limit)
+        self._received = 0
+        self._rendered = time.time()
+        
+    @property
+    def interval(self):
+        """The time between frames, in seconds."""
+        return 1.0 / self.fps
+        
+    @property
+    def due(self):
+        """Whether the next frame is due to be rendered."""
+        return time.time() - self._rendered >= self.interval
+        
+    def emit(self, record):
+        """Queue a record for the next frame."""
+        self._queue.append(record)
+        self._received += 1
+        
+    def render(self):
+        """Render a frame of queued records to the target handler."""
+        self.acquire()
+        try:
+            queue, self._queue = self._queue, collections.deque(maxlen=self.limit)
+            received, self._received = self._received, 0
+        finally:
+            self.release()
+        
+        now = time.time()
+        elapsed, self._rendered = now - self._rendered, now
+        elided = received - len(queue)
+        if elided:
+            rate = received / elapsed if elapsed > 0 else float(received)
+            summary = logging.LogRecord("lumberjack.listener", logging.WARNING, __file__, 0,
+                "{0:.0f} records/s, {1:d} elided".format(rate, elided), None, None)
+            self.target.handle(summary)
+        for record in queue:
+            self.target.handle(record)
+        if received:
+            self.target.flush()
+        
 
 class Controller(object):
     """Keyboard input controller for the log listener."""
     
     @classmethod
-    def default(cls, logger=""):
-        """Default controller, with default configuration, etc."""
+    def default(cls, logger="", fps=None, limit=50, stats=None):
+        """Default controller, with default configuration, etc.
+        
+        If ``fps`` is given, records are rendered through a
+        :class:`FrameRenderer` at that frame rate.
+        """
         handler = ColorStreamHandler("%(clevelname)s: %(message)s [%(name)s] [%(asctime)s] [%(threadName)s/%(processName)s]")
         handler.setLevel(1)
         handler._ttyraw = True
-        obj = cls(logger, handler)
+        if fps:
+            handler._autoflush = False
+            handler = FrameRenderer(handler, fps=fps, limit=limit)
+            handler.setLevel(1)
+        obj = cls(logger, handler, stats=stats)
         return obj
     
-    def __init__(self, logger, handler, stdin=sys.stdin, stdout=sys.stdout):
+    def __init__(self, logger, handler, stdin=sys.stdin, stdout=sys.stdout, stats=None):
         super(Controller, self).__init__()
         
         self._shouldrun = threading.Event()
@@ -48,6 +115,18 @@ class Controller(object):
         self.stdin = stdin
         self.stdout = stdout
         
+        self.stats = stats
+        self.stats_interval = 1.0
+        self._statsview = False
+        self._stats_rendered = 0.0
+        
+    @property
+    def renderer(self):
+        """The frame renderer, if records are being rendered in frames."""
+        if isinstance(self.handler, FrameRenderer):
+            return self.handler
+        return None
+        
     def echo(self, items):
         """Echo items to stdout."""
         self.stdout.write(items)
@@ -56,7 +135,7 @@ class Controller(object):
     def _filter_input(self):
         """Accept input as a filter."""
         backspaces = "\x08\x7f"
-        allowed_letters = string.digits+string.letters+string.punctuation+" "+backspaces
+        allowed_letters = string.digits+string.ascii_letters+string.punctuation+" "+backspaces
         self.echo("Set filter: ")
         key = self.stdin.read(1)
         filtername = []
@@ -78,15 +157,41 @@ class Controller(object):
         self.echo("\n\rFiltering for '{:s}'\n\r".format(self.filter.name))
         return
         
+    def _toggle_stats(self):
+        """Switch between the live statistics view and the log view."""
+        if self.stats is None:
+            self.echo("No statistics available.\n\r")
+            return
+        self._statsview = not self._statsview
+        if self._statsview:
+            self.logger.removeHandler(self.handler)
+            self._stats_rendered = 0.0
+        else:
+            self.logger.addHandler(self.handler)
+            self.echo("\033[2J\033[H")
+        
+    def _render_stats(self):
+        """Redraw the live statistics view."""
+        self._stats_rendered = time.time()
+        lines = self.stats.report()
+        lines.append("Press s to return to the log.")
+        self.echo("\033[2J\033[H" + "\r\n".join(lines) + "\r\n")
+        
     def run(self):
         """Run the controller."""
-        allowed_keys = "012345q"
-        allowed_letters = string.digits+string.letters+string.punctuation+" "
+        allowed_keys = "012345qs"
+        renderer = self.renderer
+        timeout = renderer.interval if renderer is not None else 0.1
         self._shouldrun.set()
         with ttyraw():
-            self.echo("Press 0-5 to change logging level. Press q to quit.\n\r")
+            self.echo("Press 0-5 to change logging level. Press s for statistics. Press q to quit.\n\r")
             while self._shouldrun.isSet():
-                ready,_,_ = select.select([self.stdin],[],[],0.1)
+                if self._statsview:
+                    if time.time() - self._stats_rendered >= self.stats_interval:
+                        self._render_stats()
+                elif renderer is not None and renderer.due:
+                    renderer.render()
+                ready,_,_ = select.select([self.stdin],[],[],timeout)
                 if self.stdin in ready:
                     self.handler.acquire()
                     try:
@@ -97,6 +202,8 @@ class Controller(object):
                                     self._shouldrun.clear()
                                 elif key.lower() == "f":
                                     self._filter_input()
+                                elif key.lower() == "s":
+                                    self._toggle_stats()
                                 else:
                                     self.echo("Setting level to {0}\n\r".format(logging.getLevelName(int(key) * 10)))
                                     self.handler.setLevel(int(key) * 10)
@@ -105,6 +212,8 @@ class Controller(object):
                                 raise KeyboardInterrupt("Got unknown character {!r}.".format(key))
                     finally:
                         self.handler.release()
+            if renderer is not None:
+                renderer.render()
         
     
 
@@ -125,12 +234,23 @@ def setup_zmq(url):
     from .zmq import ZMQLogWatcher
     return ZMQLogWatcher.from_url(url)
 
+def setup_udp(url):
+    """Set up a UDP watcher for a given URL."""
+    from .udp import UDPLogWatcher
+    return UDPLogWatcher.from_url(url)
+
+def setup_file(url):
+    """Set up a capture file watcher for a given URL."""
+    from .replay import CaptureLogWatcher
+    return CaptureLogWatcher.from_url(url)
+
 SUPPORTED_SCHEMES = {
     'redis' : setup_redis,
     'unix' : setup_redis,
     'rediss': setup_redis,
     'tcp' : setup_zmq,
-    'udp' : setup_zmq,
+    'udp' : setup_udp,
+    'file' : setup_file,
     'inproc' : setup_zmq,
     'ipc' : setup_zmq,
 }
@@ -155,23 +275,61 @@ def main(*args):
     """Main function for argument parsing and running log watcher."""
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument("url", type=urlparse, help="A URL for a logging stream.")
+    parser.add_argument("url", type=urlparse, nargs='+', help="URLs for logging streams.")
     parser.add_argument("-c","--channel", type=str, help="Channel to listen for.", default="")
     parser.add_argument("-l","--level", type=logging_level, help="Logging level", default=1)
     parser.add_argument("--pickle", action='store_const', help="Use Pickle for seralizing.", dest="serializer", const='pickle')
     parser.add_argument("--json", action='store_const', help="Use Pickle for seralizing.", dest="serializer", const='json')
+    parser.add_argument("--fps", type=float, help="Render records at this frame rate, eliding floods.", default=None)
+    parser.add_argument("--frame-limit", type=int, help="Maximum records rendered per frame.", default=50)
+    parser.add_argument("--export", type=str, help="Collect records into columns, saved to this .npz file or directory on exit.", default=None)
+    parser.add_argument("--capture", type=str, help="Capture records to this file, for lumberjack-replay.", default=None)
+    parser.add_argument("--shards", action='store_true', help="Watch the REDIS URLs as shards of one sharded stream.")
+    parser.add_argument("--merge", type=float, help="Merge streams into creation-time order, holding records for up to this many seconds.", default=None)
     opt = parser.parse_args(args)
-    print("Listening for logging messages on {0}".format(opt.url.geturl()))
-    watcher = setup(opt.url.scheme, opt.url.geturl())
+    print("Listening for logging messages on {0}".format(", ".join(url.geturl() for url in opt.url)))
+    if opt.shards:
+        from .redis import ShardedREDISLogWatcher
+        watchers = [ShardedREDISLogWatcher.from_urls([url.geturl() for url in opt.url])]
+    else:
+        watchers = [setup(url.scheme, url.geturl()) for url in opt.url]
+    stats = StreamStats()
+    merge = MergeStage(window=opt.merge) if opt.merge else None
+    for url, watcher in zip(opt.url, watchers):
+        watcher.decoder.observers.append(stats)
+        if merge is not None:
+            watcher.dispatch = functools.partial(merge.push, source=watcher.decoder.source or url.geturl())
+    if opt.capture:
+        from .replay import CaptureHandler
+        capture = CaptureHandler(opt.capture, opt.serializer or 'json')
+        logging.getLogger().addHandler(capture)
+    if opt.export:
+        from .columnar import ColumnarSink
+        sink = ColumnarSink()
+        logging.getLogger().addHandler(sink)
     try:
-        watcher.subscribe(opt.channel)
-        watcher.start()
-        controller = Controller.default()
+        if merge is not None:
+            merge.start()
+        for watcher in watchers:
+            watcher.subscribe(opt.channel)
+            watcher.start()
+        controller = Controller.default(fps=opt.fps, limit=opt.frame_limit, stats=stats)
         controller.run()
     except KeyboardInterrupt:
         print("...ending")
     finally:
-        watcher.stop()
+        for watcher in watchers:
+            watcher.stop()
+        if merge is not None:
+            merge.stop()
+            merge.join()
+            print("Merged {0:d} records, {1:d} late.".format(merge.released, merge.late))
+        print("Lost {0:d} records.".format(stats.delivery.lost))
+        if opt.capture:
+            capture.close()
+        if opt.export:
+            sink.save(opt.export)
+            print("Saved {0:d} records to {1}".format(len(sink), opt.export))
     return 0
     
 if __name__ == '__main__':
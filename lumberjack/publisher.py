@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Shared machinery for publishers, which send formatted log records to a
+transport.
+"""
+
+import os
+import uuid
+import collections
+import socket
+import logging
+import weakref
+import itertools
+
+from .serialize import SerializingFormatter
+
+__all__ = ['Publisher']
+
+_publishers = weakref.WeakSet()
+
+def _reinit_after_fork():
+    """Reinitialize every publisher in a newly forked child process."""
+    for publisher in list(_publishers):
+        publisher._check_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
+
+class Publisher(logging.Handler, object):
+    """A base class for handlers which publish records to a transport.
+    
+    Publishers are fork-safe. When the process ID changes (detected with
+    ``os.register_at_fork`` where available, and checked before each
+    record otherwise), :meth:`_after_fork` is called in the child so that
+    it can recreate its own sockets and connections, rather than share
+    the parent's. Anything the parent had queued but not sent is left
+    for the parent to send.
+    
+    Publishers can :meth:`stamp` records with a publisher ID and a
+    monotonic sequence number, so that watchers can detect lost records.
+    Sequences are counted per logger name, as transports which filter by
+    topic (like ZMQ) pass or drop every record from a logger together.
+    A forked child gets a new publisher ID.
+    
+    The stamp is passed to the formatter with :meth:`format`, and only
+    appears in the serialized record, as the record itself is shared with
+    other handlers.
+    """
+    
+    def __init__(self):
+        super(Publisher, self).__init__()
+        self._pid = os.getpid()
+        self._new_publisher_id()
+        _publishers.add(self)
+        
+    def _new_publisher_id(self):
+        """Start a new publisher ID and sequences."""
+        self.publisher_id = "{0}:{1:d}:{2}".format(socket.gethostname(), self._pid, uuid.uuid4().hex[:8])
+        self._sequences = collections.defaultdict(itertools.count)
+        
+    def stamp(self, record):
+        """Get the stamp for a record: this publisher's ID, and the next
+        sequence number for the record's logger."""
+        return {'publisher_id' : self.publisher_id, 'sequence' : next(self._sequences[record.name])}
+        
+    def format(self, record, stamp=None):
+        """Format a record, adding the stamp if the formatter serializes."""
+        fmt = self.formatter or logging._defaultFormatter
+        if stamp is not None and isinstance(fmt, SerializingFormatter):
+            return fmt.format(record, extra=stamp)
+        return fmt.format(record)
+        
+    def _check_fork(self):
+        """Reinitialize the publisher if this is a forked child process."""
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid = pid
+            self.createLock()
+            self._after_fork()
+        
+    def _reset_formatter(self):
+        """Reset the formatter's stateful encodings, so that everything is
+        sent in full again."""
+        formatter = self.formatter
+        if getattr(formatter, 'strings', None) is not None:
+            formatter.strings.reset()
+        if hasattr(formatter, 'reset_tracebacks'):
+            formatter.reset_tracebacks()
+        
+    def _after_fork(self):
+        """Reset state which must not be shared with the parent process."""
+        self._new_publisher_id()
+        self._reset_formatter()
+        
+    def handle(self, record):
+        """Handle a record, first checking whether the process has forked."""
+        if self._pid != os.getpid():
+            self._check_fork()
+        return super(Publisher, self).handle(record)
+        
+    def handle_batch(self, records):
+        """Handle a batch of records, taking the handler lock only once.
+        
+        Returns the number of records which passed the filters.
+        """
+        if self._pid != os.getpid():
+            self._check_fork()
+        records = [record for record in records if self.filter(record)]
+        if records:
+            self.acquire()
+            try:
+                self.emit_batch(records)
+            finally:
+                self.release()
+        return len(records)
+        
+    def emit_batch(self, records):
+        """Emit a batch of records. Transports which can send several
+        records at once should override this."""
+        for record in records:
+            self.emit(record)
+        
@@ -1,12 +1,20 @@
 # -*- coding: utf-8 -*-
 
 import six
+import time
+import uuid
+import bisect
+import hashlib
 import logging
-from six.moves.urllib.parse import urlparse as urlparse, parse_qs, urlencode
+import threading
+import collections
+from six.moves.urllib.parse import urlparse as urlparse, parse_qs, urlencode, urlunparse
 
 from .serialize import serializers
+from .watcher import RecordDecoder, LoggerCache
+from .publisher import Publisher
 
-__all__ = ['REDISLogWatcher', 'REDISPublisher']
+__all__ = ['REDISLogWatcher', 'REDISPublisher', 'ShardedREDISPublisher', 'ShardedREDISLogWatcher']
 
 def _handle_redis_client_args(args):
     """Handle arguments that should produce a REDIS client."""
@@ -22,17 +30,28 @@ def _handle_redis_client_args(args):
         client = redis.StrictRedis.from_url(args)
     return client
 
-class REDISPublisher(logging.Handler, object):
+def _reset_pool(client):
+    """Drop connections inherited from a parent process, without closing them."""
+    pool = client.connection_pool
+    if hasattr(pool, 'reset'):
+        pool.reset()
+
+class REDISPublisher(Publisher):
     """A REDIS publisher, which takes formatted log messages and publishes them to REDIS."""
     def __init__(self, address, channel):
         super(REDISPublisher, self).__init__()
         self.client = _handle_redis_client_args(address)
         self.channel = six.text_type(channel)
         
+    def _after_fork(self):
+        """Use fresh connections in the child process."""
+        super(REDISPublisher, self)._after_fork()
+        _reset_pool(self.client)
+        
     def emit(self, record):
         """Emit a single record."""
         try:
-            msg = self.format(record)
+            msg = self.format(record, self.stamp(record))
             self.client.publish(self.channel, msg)
             self.flush()
         except (KeyboardInterrupt, SystemExit):
@@ -40,41 +59,182 @@ class REDISPublisher(logging.Handler, object):
         except:
             self.handleError(record)
         
+    def emit_batch(self, records):
+        """Emit a batch of records in a single round trip, with a pipeline."""
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for record in records:
+                pipeline.publish(self.channel, self.format(record, self.stamp(record)))
+            pipeline.execute()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(records[-1])
+        
+    
+
+def _hash(key):
+    """Hash a key onto the ring."""
+    if isinstance(key, six.text_type):
+        key = key.encode('utf-8')
+    return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+class HashRing(object):
+    """A consistent hash ring, mapping keys onto nodes.
+    
+    Each node is placed on the ring ``replicas`` times, so that removing
+    a node only remaps its own share of the key space.
+    """
+    
+    def __init__(self, nodes, replicas=64):
+        super(HashRing, self).__init__()
+        self._ring = sorted((_hash("{0}-{1}".format(node, i)), node) for node in nodes for i in range(replicas))
+        self._hashes = [h for h, node in self._ring]
+        
+    def get(self, key):
+        """Get the node for a key."""
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._ring[index][1]
+    
+
+class ShardedREDISPublisher(Publisher):
+    """A REDIS publisher which shards records across several REDIS servers.
+    
+    Records are routed by consistent hashing on ``key``, which is either
+    the name of a record attribute (by default, the logger name) or a
+    callable taking the record. Each server has its own client and
+    connection pool. When a server fails, records routed to it are
+    dropped for ``retry_interval`` seconds, and other servers are
+    unaffected.
     
+    Each shard has its own publisher ID and sequence, as records are not
+    ordered across shards. Stateful encodings are kept per publisher ID,
+    so each shard's stream decodes on its own. When a record fails to
+    publish, it may have been the first to carry some strings or a
+    traceback, so the formatter's state is reset and everything is sent
+    in full again.
+    """
+    
+    def __init__(self, addresses, channel, key='name', replicas=64, retry_interval=5.0):
+        super(ShardedREDISPublisher, self).__init__()
+        import redis
+        self.clients = [_handle_redis_client_args(address) for address in addresses]
+        self.channel = six.text_type(channel)
+        self.key = key
+        self.retry_interval = retry_interval
+        nodes = [address if isinstance(address, six.string_types) else "shard-{0}".format(i)
+                 for i, address in enumerate(addresses)]
+        if len(set(nodes)) != len(nodes):
+            raise ValueError("Duplicate REDIS shards in {0!r}".format(addresses))
+        self._ring = HashRing(nodes, replicas)
+        self._nodes = dict((node, i) for i, node in enumerate(nodes))
+        self._routes = {}
+        self._retry_at = [0.0] * len(self.clients)
+        self.dropped = [0] * len(self.clients)
+        self._errors = (redis.ConnectionError, redis.TimeoutError)
+        
+    def _new_publisher_id(self):
+        """Start a new publisher ID, and sequences for each shard."""
+        super(ShardedREDISPublisher, self)._new_publisher_id()
+        self._shard_ids = {}
+        
+    def stamp(self, record, index=0):
+        """Get the stamp for a record: the shard's publisher ID, and the next
+        sequence number for the record's logger on that shard."""
+        publisher_id = self._shard_ids.get(index)
+        if publisher_id is None:
+            publisher_id = self._shard_ids[index] = "{0}/{1:d}".format(self.publisher_id, index)
+        return {'publisher_id' : publisher_id, 'sequence' : next(self._sequences[index, record.name])}
+        
+    def _after_fork(self):
+        """Use fresh connections to every shard in the child process."""
+        super(ShardedREDISPublisher, self)._after_fork()
+        for client in self.clients:
+            _reset_pool(client)
+        
+    def route(self, record):
+        """Get the index of the client for a record."""
+        key = self.key(record) if callable(self.key) else getattr(record, self.key, "")
+        index = self._routes.get(key)
+        if index is None:
+            if len(self._routes) >= 4096:
+                self._routes.clear()
+            node = self._ring.get(six.text_type(key))
+            index = self._routes[key] = self._nodes[node]
+        return index
+        
+    def emit(self, record):
+        """Emit a single record to its shard."""
+        try:
+            index = self.route(record)
+            if self._retry_at[index] > time.time():
+                self.dropped[index] += 1
+                return
+            msg = self.format(record, self.stamp(record, index))
+            try:
+                self.clients[index].publish(self.channel, msg)
+            except self._errors:
+                self._retry_at[index] = time.time() + self.retry_interval
+                self._reset_formatter()
+                raise
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+        
 
-class REDISLogWatcher(object):
-    """Watch a REDIS channel for logging"""
-    def __init__(self, address, channel, deserialize=None, logger=None):
+class REDISLogWatcher(threading.Thread, object):
+    """Watch REDIS channels for logging.
+    
+    The watcher thread blocks on the REDIS connection, and handles every
+    waiting message each time it wakes up. Channels can be subscribed by
+    name, or by glob-style pattern. Subscribing and stopping wake the
+    thread through a private control channel.
+    """
+    def __init__(self, address, channel=None, deserialize=None, logger=None, timeout=10.0):
         super(REDISLogWatcher, self).__init__()
+        self.daemon = True
         self.client = _handle_redis_client_args(address)
-        self.channels = [six.text_type(channel)]
-        self.deserialize = deserialize if deserialize is not None else serializers['pickle'].deserialize
+        self.channels = set()
+        self.patterns = set()
+        self.timeout = timeout
+        source = address if isinstance(address, six.string_types) else None
+        self.decoder = RecordDecoder(deserialize if deserialize is not None else serializers['pickle'].deserialize, source=source)
         if isinstance(logger, six.string_types):
             logger = logging.getLogger(logger)
         self._logger = logger
-        self.thread = None
+        self.loggers = LoggerCache()
+        self.dispatch = self.loggers.handle if logger is None else logger.handle
+        
+        self._control = "lumberjack-watcher-{0}".format(uuid.uuid4().hex)
+        self._control_channels = set([self._control, self._control.encode('utf-8')])
+        self._subscriptions = collections.deque([('subscribe', self._control)])
+        self._shouldrun = threading.Event()
+        if channel:
+            self.subscribe(channel)
         
     @classmethod
     def from_url(cls, url):
         """Create the log watcher from a URL"""
         
-        
         # Get the options out of the URL.
         result = urlparse(url)
         options = parse_qs(result.query)
-        channel = options.get("channel", "")
-        serializer = serializers[options.get("serialize", "json")]
+        channel = options.get("channel", [""])[0]
+        serializer = serializers[options.get("serialize", ["json"])[0]]
         
         # Rebuild the URL without the query string.
         args = list(result)
         if 'db' in options:
-            args[4] = urlencode([('db', options['db'])])
+            args[4] = urlencode([('db', options['db'][0])])
         else:
             args[4] = ''
         url = urlunparse(args)
         
         # Set up the object.
         obj = cls(url, channel, serializer.deserialize)
+        for pattern in options.get("pattern", []):
+            obj.psubscribe(pattern)
         return obj
     
     @property
@@ -85,32 +245,119 @@ class REDISLogWatcher(object):
         else:
             return self._logger
     
-    def _redis_responder(self, msg):
-        """Given a REDIS message, create the logrecord and handle it."""
-        if msg['channel'] in self.channels:
-            record = self.deserialize(msg['data'])
-            if self._logger is None:
-                logging.getLogger(record.name).handle(record)
-            else:
-                self.logger.handle(record)
+    def _wake(self):
+        """Wake the watcher thread."""
+        if self.is_alive():
+            self.client.publish(self._control, b"")
     
     def subscribe(self, name):
-        """Subscribe to an addtional channel."""
-        self.channels.append(name)
+        """Subscribe to an addtional channel. REDIS channels are not
+        prefixes, so an empty channel name is ignored."""
+        if name and name not in self.channels:
+            self.channels.add(name)
+            self._subscriptions.append(('subscribe', name))
+            self._wake()
+    
+    def psubscribe(self, pattern):
+        """Subscribe to every channel matching a glob-style pattern."""
+        if pattern not in self.patterns:
+            self.patterns.add(pattern)
+            self._subscriptions.append(('psubscribe', pattern))
+            self._wake()
+    
+    def _adjust_subscriptions(self, pubsub):
+        """Apply subscriptions made from other threads."""
+        while len(self._subscriptions):
+            (method, name) = self._subscriptions.popleft()
+            getattr(pubsub, method)(name)
+    
+    def _handle_message(self, message):
+        """Given a REDIS message, create the logrecord and handle it."""
+        if message['channel'] in self._control_channels:
+            return
+        record = self.decoder(message['data'])
+        self.dispatch(record)
     
     def start(self):
         """Start the log watcher."""
-        pubsub = self.client.pubsub()
-        for channel in self.channels:
-            pubsub.subscribe(**{channel:self._redis_responder})
-        self.thread = pubsub.run_in_thread(sleep_time=0.01)
+        self._shouldrun.set()
+        super(REDISLogWatcher, self).start()
     
     def stop(self):
         """Stop the log watcher"""
-        if self.thread is not None:
-            self.thread.stop()
+        if not self._shouldrun.isSet():
+            return
+        self._shouldrun.clear()
+        self._wake()
+    
+    def run(self):
+        """Run the log watcher."""
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        try:
+            while self._shouldrun.isSet():
+                self._adjust_subscriptions(pubsub)
+                message = pubsub.get_message(timeout=self.timeout)
+                while message is not None:
+                    self._handle_message(message)
+                    message = pubsub.get_message(timeout=0)
+        finally:
+            pubsub.close()
+        
+
+class ShardedREDISLogWatcher(object):
+    """Watch a REDIS channel across several REDIS servers, merging the
+    records from all of them.
+    
+    All shards share a single decoder, which locks around its shared
+    state, as each shard has its own thread.
+    """
+    def __init__(self, addresses, channel=None, deserialize=None, logger=None):
+        super(ShardedREDISLogWatcher, self).__init__()
+        self._share([REDISLogWatcher(address, channel, deserialize, logger) for address in addresses])
+        
+    @classmethod
+    def from_urls(cls, urls):
+        """Create the log watcher from one URL per shard, each as for
+        :meth:`REDISLogWatcher.from_url`."""
+        obj = cls.__new__(cls)
+        obj._share([REDISLogWatcher.from_url(url) for url in urls])
+        return obj
+        
+    def _share(self, watchers):
+        """Share one decoder between the shards' watchers."""
+        self.watchers = watchers
+        self.decoder = self.watchers[0].decoder
+        sources = [watcher.decoder.source for watcher in self.watchers]
+        self.decoder.source = ",".join(sources) if all(sources) else None
+        for watcher in self.watchers:
+            watcher.decoder = self.decoder
+        
+    @property
+    def dispatch(self):
+        """The callable which handles records from every shard."""
+        return self.watchers[0].dispatch
         
-    def __del__(self):
-        """Remove the child thread if necessary."""
-        if hasattr(self.thread, 'stop'):
-            self.thread.stop()
+    @dispatch.setter
+    def dispatch(self, value):
+        for watcher in self.watchers:
+            watcher.dispatch = value
+        
+    def subscribe(self, name):
+        """Subscribe to an additional channel on every shard."""
+        for watcher in self.watchers:
+            watcher.subscribe(name)
+        
+    def psubscribe(self, pattern):
+        """Subscribe to every channel matching a pattern on every shard."""
+        for watcher in self.watchers:
+            watcher.psubscribe(pattern)
+        
+    def start(self):
+        """Start watching every shard."""
+        for watcher in self.watchers:
+            watcher.start()
+        
+    def stop(self):
+        """Stop watching every shard."""
+        for watcher in self.watchers:
+            watcher.stop()
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Capture log streams to files, and replay them into handlers and
+transports.
+
+A capture file starts with a header line naming the serializer used,
+followed by frames of the record's creation time, the payload length,
+and the serialized record.
+"""
+
+from __future__ import print_function, absolute_import
+
+import io
+import os
+import sys
+import six
+import glob
+import gzip
+import time
+import struct
+import logging
+import itertools
+import threading
+
+from six.moves.urllib.parse import urlparse, parse_qs
+
+from .serialize import serializers
+from .watcher import RecordDecoder, LoggerCache
+
+__all__ = ['CaptureWriter', 'CaptureReader', 'CaptureHandler', 'CaptureLogWatcher', 'replay']
+
+MAGIC = b"LJCAP1"
+
+_frame = struct.Struct(">dI")
+
+def _open(path, mode):
+    """Open a capture file, which may be gzip compressed."""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return io.open(path, mode)
+
+class CaptureWriter(object):
+    """Write serialized records to a capture file."""
+    
+    def __init__(self, fileobj, serializer="json"):
+        super(CaptureWriter, self).__init__()
+        if serializer not in serializers:
+            raise ValueError("Unknown serializer {0!r}".format(serializer))
+        self.serializer = serializer
+        self.fileobj = fileobj
+        self.fileobj.write(MAGIC + b" " + serializer.encode('ascii') + b"\n")
+        
+    def write(self, created, payload):
+        """Write a single serialized record, returning the number of bytes written."""
+        if isinstance(payload, six.text_type):
+            payload = payload.encode('utf-8')
+        self.fileobj.write(_frame.pack(created, len(payload)))
+        self.fileobj.write(payload)
+        return _frame.size + len(payload)
+        
+    def flush(self):
+        """Flush the capture file."""
+        self.fileobj.flush()
+        
+    def close(self):
+        """Close the capture file."""
+        self.fileobj.close()
+    
+
+class CaptureReader(object):
+    """Read a capture file, one frame at a time.
+    
+    Iterating over the reader yields ``(created, payload)`` pairs, and
+    :meth:`records` yields deserialized log records. Only one frame is
+    held in memory at a time.
+    """
+    
+    def __init__(self, fileobj):
+        super(CaptureReader, self).__init__()
+        self.fileobj = fileobj
+        header = self.fileobj.readline().split()
+        if len(header) != 2 or header[0] != MAGIC:
+            raise ValueError("Not a lumberjack capture file.")
+        self.serializer = header[1].decode('ascii')
+        
+    @classmethod
+    def open(cls, path):
+        """Open a capture file by path."""
+        return cls(_open(path, 'rb'))
+        
+    def __iter__(self):
+        while True:
+            header = self.fileobj.read(_frame.size)
+            if len(header) < _frame.size:
+                return
+            created, size = _frame.unpack(header)
+            payload = self.fileobj.read(size)
+            if len(payload) < size:
+                return
+            yield created, payload
+        
+    def records(self, deserialize=None):
+        """Yield each record in the capture file."""
+        if deserialize is None:
+            deserialize = serializers[self.serializer].deserialize
+        for created, payload in self:
+            yield deserialize(payload)
+        
+    def close(self):
+        """Close the capture file."""
+        self.fileobj.close()
+    
+
+class CaptureHandler(logging.Handler, object):
+    """A handler which captures records to a capture file, for replay."""
+    
+    def __init__(self, path, serializer="json"):
+        super(CaptureHandler, self).__init__()
+        self.writer = CaptureWriter(_open(path, 'wb'), serializer)
+        self.setFormatter(serializers[serializer]())
+        
+    def emit(self, record):
+        """Capture a single record."""
+        try:
+            self.writer.write(record.created, self.format(record))
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+        
+    def flush(self):
+        """Flush the capture file."""
+        self.acquire()
+        try:
+            self.writer.flush()
+        finally:
+            self.release()
+        
+    def close(self):
+        """Close the capture file."""
+        self.acquire()
+        try:
+            self.writer.close()
+        finally:
+            self.release()
+        super(CaptureHandler, self).close()
+    
+
+def replay(records, handle, speed=1.0, retime=False):
+    """Re-emit records through handle, keeping their relative timing.
+    
+    Parameters
+    ----------
+    records : iterable of LogRecord
+        The records to replay.
+    handle : callable
+        Called with each record, e.g. a handler's ``handle`` method.
+    speed : float
+        The replay speed, relative to the original stream. Zero (or None)
+        replays as fast as possible.
+    retime : bool
+        Shift each record's creation time so the stream appears to be
+        happening now.
+    
+    Returns
+    -------
+    count : int
+        The number of records replayed.
+    elapsed : float
+        The time taken, in seconds.
+    """
+    count = 0
+    start = time.time()
+    first = None
+    for record in records:
+        if first is None:
+            first = record.created
+            start = time.time()
+        if speed:
+            delay = (record.created - first) / speed - (time.time() - start)
+            if delay > 0.001:
+                time.sleep(delay)
+        if retime:
+            record.created += start - first
+        handle(record)
+        count += 1
+    return count, time.time() - start
+    
+
+class CaptureLogWatcher(threading.Thread, object):
+    """A log watcher which reads records from capture files, e.g. the
+    segments written by :class:`~lumberjack.files.SegmentFileHandler`.
+    
+    ``path`` may be a glob pattern, in which case the matching files are
+    read in order of modification time. Records are replayed as fast as
+    possible, or at ``speed`` times their original rate.
+    """
+    
+    @classmethod
+    def from_url(cls, url):
+        """Make a log watcher with a URL, like ``file:///var/log/app*.cap?speed=1``."""
+        result = urlparse(url)
+        options = parse_qs(result.query)
+        return cls(result.netloc + result.path, speed=float(options.get("speed", ["0"])[0]))
+    
+    def __init__(self, path, speed=0.0):
+        super(CaptureLogWatcher, self).__init__()
+        self.daemon = True
+        self.path = path
+        self.speed = speed
+        self.decoder = RecordDecoder(None, source="file://{0}".format(path))
+        self.loggers = LoggerCache()
+        self.dispatch = self.loggers.handle
+        self._subscriptions = []
+        self._shouldrun = threading.Event()
+        
+    def subscribe(self, name):
+        """Subscribe to records from loggers starting with name."""
+        self._subscriptions.append(name)
+        
+    def start(self):
+        """Start the thread."""
+        self._shouldrun.set()
+        super(CaptureLogWatcher, self).start()
+        
+    def stop(self):
+        """Stop this thread."""
+        self._shouldrun.clear()
+        
+    def _records(self):
+        """Yield records from each matching capture file in turn."""
+        for path in sorted(glob.glob(self.path), key=os.path.getmtime):
+            reader = CaptureReader.open(path)
+            try:
+                self.decoder.deserialize = serializers[reader.serializer].deserialize
+                for created, payload in reader:
+                    yield self.decoder(payload)
+            finally:
+                reader.close()
+        
+    def _handle(self, record):
+        """Dispatch a record, if it is subscribed to."""
+        if any(record.name.startswith(name) for name in self._subscriptions):
+            self.dispatch(record)
+        
+    def run(self):
+        """Run the log watcher, until the files are exhausted."""
+        records = itertools.takewhile(lambda record : self._shouldrun.isSet(), self._records())
+        replay(records, self._handle, speed=self.speed)
+    
+
+def main(*args):
+    """Main function for argument parsing and replaying a capture file."""
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture", type=str, help="A capture file to replay.")
+    parser.add_argument("--zmq", type=str, help="Replay to a ZMQ address.", default=None)
+    parser.add_argument("--bind", action='store_true', help="Bind the ZMQ address, rather than connecting.")
+    parser.add_argument("--redis", type=str, help="Replay to a REDIS URL.", default=None)
+    parser.add_argument("-c", "--channel", type=str, help="REDIS channel to publish to.", default="logging")
+    parser.add_argument("--udp", type=str, help="Replay to a UDP host:port.", default=None)
+    parser.add_argument("-s", "--speed", type=float, help="Replay speed, relative to the original stream.", default=1.0)
+    parser.add_argument("--fast", action='store_const', help="Replay as fast as possible.", dest="speed", const=0.0)
+    parser.add_argument("--retime", action='store_true', help="Shift records to the current time.")
+    parser.add_argument("--pickle", action='store_const', help="Use Pickle for seralizing.", dest="serializer", const='pickle')
+    parser.add_argument("--json", action='store_const', help="Use JSON for seralizing.", dest="serializer", const='json')
+    opt = parser.parse_args(args or None)
+    
+    if opt.zmq:
+        from .zmq import ZMQPublisher
+        handler = ZMQPublisher(opt.zmq, bind=opt.bind)
+    elif opt.redis:
+        from .redis import REDISPublisher
+        handler = REDISPublisher(opt.redis, opt.channel)
+    elif opt.udp:
+        from .udp import UDPPublisher
+        handler = UDPPublisher(opt.udp)
+    else:
+        from .streams import ColorStreamHandler
+        handler = ColorStreamHandler("%(clevelname)s: %(message)s [%(name)s] [%(asctime)s]")
+    if handler.formatter is None:
+        handler.setFormatter(serializers[opt.serializer or 'json']())
+    
+    reader = CaptureReader.open(opt.capture)
+    try:
+        count, elapsed = replay(reader.records(), handler.handle, speed=opt.speed, retime=opt.retime)
+    except KeyboardInterrupt:
+        print("...ending")
+        return 1
+    finally:
+        reader.close()
+        handler.close()
+    rate = count / elapsed if elapsed > 0 else float('inf')
+    print("Replayed {0:d} records in {1:.2f}s ({2:.0f} records/s)".format(count, elapsed, rate))
+    return 0
+    
+if __name__ == '__main__':
+    sys.exit(main())
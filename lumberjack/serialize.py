@@ -3,25 +3,104 @@
 Lumberjack utilities for serializing log records.
 """
 
+import six
 from six.moves import cPickle as pickle
 import logging
 import struct
 import json
 import functools
+import hashlib
+import collections
+import time
+import uuid
+import datetime
+import decimal
 
 class SerializingFormatter(logging.Formatter, object):
-    """A base class for serializing formatters."""
+    """A base class for serializing formatters.
+    
+    With ``dedup_tracebacks=True``, the full traceback text is sent only the
+    first time it is seen on each topic (publisher ID and logger name), and
+    again once ``traceback_window`` seconds have passed. Later records carry
+    only ``exc_fingerprint`` and ``exc_repeat``, and a
+    :class:`TracebackCache` on the receiving end rebuilds ``exc_text``.
+    
+    With ``string_table=True`` (or a :class:`StringTableEncoder` instance),
+    repeated string fields are sent as small integer IDs. As the encoder is
+    stateful, each publisher should have its own formatter.
+    
+    With ``prerender=True``, the message is rendered once with
+    ``getMessage()`` and sent in place of ``msg``, and ``args`` are
+    dropped. The receiving end sees exactly the same message text.
+    
+    Fields in ``extra`` (such as a publisher's stamp) are added to the
+    serialized copy of the record, and never to the record itself.
+    """
     
     serializer = lambda d : d
     deserializer = logging.makeLogRecord
     
-    def format(self, record):
+    traceback_maxsize = 256
+    
+    def __init__(self, *args, **kwargs):
+        self.dedup_tracebacks = kwargs.pop('dedup_tracebacks', False)
+        self.traceback_window = kwargs.pop('traceback_window', 60.0)
+        strings = kwargs.pop('string_table', False)
+        self.prerender = kwargs.pop('prerender', False)
+        super(SerializingFormatter, self).__init__(*args, **kwargs)
+        if strings is True:
+            strings = StringTableEncoder()
+        self.strings = strings or None
+        self._sent_tracebacks = collections.OrderedDict()
+        
+    def reset_tracebacks(self):
+        """Forget which tracebacks have been sent, e.g. after reconnecting."""
+        self._sent_tracebacks.clear()
+        
+    def _dedup_traceback(self, data):
+        """Replace repeated traceback text in data with its fingerprint."""
+        text = data['exc_text']
+        if isinstance(text, six.text_type):
+            text = text.encode('utf-8')
+        fingerprint = hashlib.sha1(text).hexdigest()[:16]
+        key = (data.get('publisher_id'), data.get('name'), fingerprint)
+        now = time.time()
+        state = self._sent_tracebacks.pop(key, None)
+        if state is None or (self.traceback_window is not None and now - state[0] > self.traceback_window):
+            state = [now, 0]
+        else:
+            state[1] += 1
+            data['exc_text'] = None
+        if len(self._sent_tracebacks) >= self.traceback_maxsize:
+            self._sent_tracebacks.popitem(last=False)
+        self._sent_tracebacks[key] = state
+        data['exc_fingerprint'] = fingerprint
+        data['exc_repeat'] = state[1]
+    
+    def format(self, record, extra=None):
         """Format a record, carefully handling exc_info."""
         ei = record.exc_info
         if ei:
             dummy = super(SerializingFormatter, self).format(record) # just to get traceback text into record.exc_text
             record.exc_info = None  # to avoid Unpickleable error
-        s = self.serializer(record.__dict__)
+        data = record.__dict__
+        if self.prerender:
+            data = dict(data)
+            data['msg'] = record.getMessage()
+            data['args'] = None
+        if extra:
+            if data is record.__dict__:
+                data = dict(data)
+            data.update(extra)
+        if self.dedup_tracebacks and record.exc_text:
+            if data is record.__dict__:
+                data = dict(data)
+            self._dedup_traceback(data)
+        if self.strings is not None:
+            if data is record.__dict__:
+                data = dict(data)
+            self.strings.encode(data)
+        s = self.serializer(data)
         if ei:
             record.exc_info = ei  # for next handler
         return s
@@ -40,28 +119,223 @@ class PickleFormatter(SerializingFormatter):
     
     @classmethod
     def deserializer(cls, s):
-        """docstring for deserializer"""
+        """Deserialize a record, with or without its length prefix."""
+        if len(s) >= 4 and struct.unpack(">L", s[:4])[0] == len(s) - 4:
+            s = s[4:]
         return logging.makeLogRecord(pickle.loads(s))
     
-    def format(self, record):
+    def format(self, record, extra=None):
         """
         Pickles the record in binary format with a length prefix, and
         returns it ready for transmission across the socket.
         """
-        s = super(PickleFormatter, self).format(record)
+        s = super(PickleFormatter, self).format(record, extra)
         slen = struct.pack(">L", len(s))
         return slen + s
         
 
+def _coerce_bytes(value):
+    """Coerce bytes to text."""
+    return value.decode('utf-8', 'replace')
+    
+def _coerce_isoformat(value):
+    """Coerce dates and times to ISO 8601 strings."""
+    return value.isoformat()
+    
+_coercions = [
+    (six.binary_type, _coerce_bytes),
+    ((set, frozenset, collections.deque), list),
+    ((datetime.datetime, datetime.date, datetime.time), _coerce_isoformat),
+    (decimal.Decimal, float),
+    (uuid.UUID, str),
+    (datetime.timedelta, datetime.timedelta.total_seconds),
+]
+
+_coercers = {}
+_coercers_maxsize = 1024
+
+def coerce(value):
+    """Coerce a value which JSON can't serialize into one which it can.
+    
+    The coercion for each type is looked up once, and cached. Anything
+    without a more specific coercion becomes its ``repr``.
+    """
+    kind = type(value)
+    try:
+        coercer = _coercers[kind]
+    except KeyError:
+        for kinds, coercer in _coercions:
+            if issubclass(kind, kinds):
+                break
+        else:
+            coercer = repr
+        if len(_coercers) >= _coercers_maxsize:
+            _coercers.clear()
+        _coercers[kind] = coercer
+    return coercer(value)
+
 class JSONFormatter(SerializingFormatter):
-    """Format an entire logrecord in JSON, suitable for transmission over a simple wire."""
+    """Format an entire logrecord in JSON, suitable for transmission over a simple wire.
+    
+    In ``prerender`` mode, values which JSON can't serialize are passed
+    through :func:`coerce` rather than failing the whole record.
+    """
     
     serializer = functools.partial(json.dumps, skipkeys=True)
     
+    def __init__(self, *args, **kwargs):
+        super(JSONFormatter, self).__init__(*args, **kwargs)
+        if self.prerender:
+            self.serializer = functools.partial(json.dumps, skipkeys=True, default=coerce)
+    
     @classmethod
     def deserializer(cls, s):
-        """docstring for deserializer"""
-        return logging.makeLogRecord(json.loads(s))
+        """Make a record from JSON. JSON has no tuples, so a list of
+        arguments is turned back into a tuple for ``getMessage``."""
+        data = json.loads(s)
+        if isinstance(data.get('args'), list):
+            data['args'] = tuple(data['args'])
+        return logging.makeLogRecord(data)
+
+class StringTableEncoder(object):
+    """Replace repeated string fields with small integer IDs.
+    
+    Each string is sent in full the first time it is seen on a topic,
+    along with the ID assigned to it. After that, only the ID is sent on
+    that topic. A topic is a publisher ID and logger name, as subscribers
+    which filter by topic (like ZMQ) only see some loggers, and each shard
+    of a sharded publisher has its own publisher ID. Every topic sends
+    its strings again after each refresh, every ``refresh_every`` records
+    or ``refresh_interval`` seconds, so that late subscribers (and
+    subscribers which dropped a message) can resynchronize. Each table
+    has a random key, so that a single :class:`StringTableDecoder` can
+    follow many publishers.
+    """
+    
+    fields = ('name', 'pathname', 'filename', 'module', 'funcName', 'threadName', 'processName', 'publisher_id')
+    
+    def __init__(self, fields=None, refresh_every=1000, refresh_interval=5.0, maxsize=4096):
+        super(StringTableEncoder, self).__init__()
+        if fields is not None:
+            self.fields = tuple(fields)
+        self.refresh_every = refresh_every
+        self.refresh_interval = refresh_interval
+        self.maxsize = maxsize
+        self.reset()
+        
+    def reset(self):
+        """Start a new, empty table."""
+        self.key = uuid.uuid4().hex[:12]
+        self._ids = {}
+        self._sent = {}
+        self._count = 0
+        self._refreshed = time.time()
+        
+    def encode(self, data):
+        """Encode the string fields of a record dictionary in place."""
+        if len(self._ids) + len(self.fields) > self.maxsize:
+            self.reset()
+        self._count += 1
+        if self._count >= self.refresh_every or time.time() - self._refreshed >= self.refresh_interval:
+            self._sent.clear()
+            self._count = 0
+            self._refreshed = time.time()
+        
+        topic = (data.get('publisher_id'), data.get('name'))
+        sent = self._sent.get(topic)
+        if sent is None:
+            if len(self._sent) >= self.maxsize:
+                self._sent.clear()
+            sent = self._sent[topic] = set()
+        new = {}
+        for field in self.fields:
+            value = data.get(field)
+            if isinstance(value, six.string_types):
+                index = self._ids.get(value)
+                if index is None:
+                    index = self._ids[value] = len(self._ids)
+                if index not in sent:
+                    sent.add(index)
+                    new[index] = value
+                data[field] = index
+        
+        # String keys, so that the table survives a round trip through JSON.
+        data['_strtab'] = [self.key, dict((str(index), value) for index, value in new.items())]
+        return data
+    
+
+class StringTableDecoder(object):
+    """Restore string fields encoded by a :class:`StringTableEncoder`.
+    
+    Tables are kept per publisher, and at most ``maxtables`` tables are
+    remembered at once.
+    """
+    
+    def __init__(self, fields=None, maxtables=64):
+        super(StringTableDecoder, self).__init__()
+        self.fields = tuple(fields) if fields is not None else StringTableEncoder.fields
+        self.maxtables = maxtables
+        self._tables = collections.OrderedDict()
+        
+    def restore(self, record):
+        """Restore the string fields of a record in place."""
+        strtab = record.__dict__.pop('_strtab', None)
+        if strtab is None:
+            return record
+        key, new = strtab
+        table = self._tables.pop(key, None)
+        if table is None:
+            table = {}
+        if len(self._tables) >= self.maxtables:
+            self._tables.popitem(last=False)
+        self._tables[key] = table
+        for index, value in new.items():
+            table[int(index)] = value
+        
+        for field in self.fields:
+            value = record.__dict__.get(field)
+            if isinstance(value, six.integer_types) and not isinstance(value, bool):
+                text = table.get(value)
+                if text is None:
+                    text = "<unknown string {0}>".format(value)
+                record.__dict__[field] = text
+        return record
+        
+
+class TracebackCache(object):
+    """A bounded cache of traceback text, keyed by fingerprint.
+    
+    This is the receiving half of ``dedup_tracebacks``: records which carry
+    the full traceback text fill the cache, and records which carry only a
+    fingerprint have their ``exc_text`` rebuilt from it.
+    """
+    
+    def __init__(self, maxsize=256):
+        super(TracebackCache, self).__init__()
+        self.maxsize = maxsize
+        self._tracebacks = collections.OrderedDict()
+        
+    def __len__(self):
+        return len(self._tracebacks)
+        
+    def restore(self, record):
+        """Restore exc_text on a record, or remember it for later records."""
+        fingerprint = getattr(record, 'exc_fingerprint', None)
+        if fingerprint is None:
+            return record
+        text = self._tracebacks.pop(fingerprint, None)
+        if record.exc_text:
+            text = record.exc_text
+        elif text is None:
+            text = "Traceback {0} repeated {1} times (full text not received)".format(fingerprint, record.exc_repeat)
+            record.exc_text = text
+            return record
+        if len(self._tracebacks) >= self.maxsize:
+            self._tracebacks.popitem(last=False)
+        self._tracebacks[fingerprint] = text
+        record.exc_text = text
+        return record
+        
 
 serializers = {
     'json' : JSONFormatter,
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Live throughput statistics for log streams, in fixed memory.
+"""
+
+import time
+import bisect
+import threading
+import collections
+
+__all__ = ['WindowCounter', 'HeavyHitters', 'LatencyHistogram', 'DeliveryTracker', 'StreamStats']
+
+class WindowCounter(object):
+    """Count events over a sliding time window.
+    
+    The window is split into a fixed number of buckets, so memory use
+    does not depend on the event rate.
+    """
+    
+    def __init__(self, window=10.0, buckets=10):
+        super(WindowCounter, self).__init__()
+        self.window = window
+        self.width = window / buckets
+        self._counts = [0] * buckets
+        self._current = int(time.time() / self.width)
+        
+    def _advance(self, now):
+        """Advance the window to now, clearing expired buckets."""
+        bucket = int(now / self.width)
+        if bucket > self._current:
+            nbuckets = len(self._counts)
+            for step in range(1, min(bucket - self._current, nbuckets) + 1):
+                self._counts[(self._current + step) % nbuckets] = 0
+            self._current = bucket
+        
+    def add(self, count=1, now=None):
+        """Count events."""
+        self._advance(time.time() if now is None else now)
+        self._counts[self._current % len(self._counts)] += count
+        
+    def total(self, now=None):
+        """Total events in the window."""
+        self._advance(time.time() if now is None else now)
+        return sum(self._counts)
+        
+    def rate(self, now=None):
+        """Events per second, over the window."""
+        return self.total(now) / self.window
+    
+
+class HeavyHitters(object):
+    """Approximate the most frequent keys in a stream.
+    
+    Each bucket of the sliding window is a Misra-Gries summary holding at
+    most ``capacity`` counters, so memory use is fixed no matter how many
+    distinct keys are seen. Any key with more than ``1/capacity`` of the
+    events in a bucket is guaranteed to be kept, and counts are
+    underestimated by at most that amount.
+    """
+    
+    def __init__(self, capacity=64, window=10.0, buckets=5):
+        super(HeavyHitters, self).__init__()
+        self.capacity = capacity
+        self.window = window
+        self.width = window / buckets
+        self._sketches = [{} for i in range(buckets)]
+        self._current = int(time.time() / self.width)
+        
+    def _advance(self, now):
+        """Advance the window to now, clearing expired sketches."""
+        bucket = int(now / self.width)
+        if bucket > self._current:
+            nbuckets = len(self._sketches)
+            for step in range(1, min(bucket - self._current, nbuckets) + 1):
+                self._sketches[(self._current + step) % nbuckets] = {}
+            self._current = bucket
+        
+    def add(self, key, now=None):
+        """Count a single occurrence of key."""
+        self._advance(time.time() if now is None else now)
+        sketch = self._sketches[self._current % len(self._sketches)]
+        if key in sketch:
+            sketch[key] += 1
+        elif len(sketch) < self.capacity:
+            sketch[key] = 1
+        else:
+            # Decrement every counter. Each decrement is paid for by an
+            # earlier increment, so this is amortized constant time.
+            for other in list(sketch):
+                count = sketch[other] - 1
+                if count:
+                    sketch[other] = count
+                else:
+                    del sketch[other]
+        
+    def top(self, n=10, now=None):
+        """The n most frequent keys in the window, with their approximate counts."""
+        self._advance(time.time() if now is None else now)
+        counts = collections.Counter()
+        for sketch in self._sketches:
+            counts.update(sketch)
+        return counts.most_common(n)
+    
+
+class LatencyHistogram(object):
+    """A histogram of latencies, in fixed memory.
+    
+    Buckets grow geometrically, with ``resolution`` buckets per doubling,
+    from ``minimum`` seconds up to ``maximum`` seconds. Negative latencies
+    (from clock skew between hosts) are counted in the first bucket.
+    """
+    
+    def __init__(self, minimum=1e-4, maximum=1e3, resolution=4):
+        super(LatencyHistogram, self).__init__()
+        self.bounds = []
+        bound = minimum
+        while bound < maximum:
+            self.bounds.append(bound)
+            bound *= 2.0 ** (1.0 / resolution)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        
+    def add(self, latency):
+        """Count a single latency, in seconds."""
+        self.counts[bisect.bisect_left(self.bounds, latency)] += 1
+        self.total += 1
+        
+    def percentile(self, percent):
+        """The upper bound of the bucket holding the given percentile, in seconds."""
+        if not self.total:
+            return None
+        target = self.total * percent / 100.0
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                break
+        return self.bounds[index] if index < len(self.bounds) else float('inf')
+    
+
+class DeliveryTracker(object):
+    """Track lost records and end-to-end latency.
+    
+    Records stamped by a :class:`~lumberjack.publisher.Publisher` carry
+    a publisher ID and a sequence number for their logger. Gaps in the
+    sequence for each publisher and logger are counted as lost, and records
+    which arrive late to fill a gap are taken back off the count. Loggers
+    filtered out by a subscription never arrive at all, so they are never
+    counted as lost. At most ``maxstreams`` publisher and logger pairs are
+    tracked at once.
+    
+    Latency is measured as the time the record was received, less
+    ``record.created``, so it depends on the clocks of the publishing
+    and receiving hosts agreeing.
+    """
+    
+    def __init__(self, maxstreams=4096):
+        super(DeliveryTracker, self).__init__()
+        self.maxstreams = maxstreams
+        self.latency = LatencyHistogram()
+        self._streams = collections.OrderedDict()
+        self._lock = threading.Lock()
+        
+    def observe(self, record, size=None, source=None):
+        """Track a single record."""
+        now = time.time()
+        with self._lock:
+            self.latency.add(now - record.created)
+            publisher = getattr(record, 'publisher_id', None)
+            sequence = getattr(record, 'sequence', None)
+            if publisher is None or sequence is None:
+                return
+            
+            # State is [next expected sequence, received, lost].
+            key = (publisher, record.name)
+            state = self._streams.pop(key, None)
+            if state is None:
+                state = [sequence + 1, 1, 0]
+            else:
+                if sequence >= state[0]:
+                    state[2] += sequence - state[0]
+                    state[0] = sequence + 1
+                elif state[2]:
+                    state[2] -= 1
+                state[1] += 1
+            if len(self._streams) >= self.maxstreams:
+                self._streams.popitem(last=False)
+            self._streams[key] = state
+        
+    def loss(self):
+        """Records received and lost, by publisher ID."""
+        totals = {}
+        with self._lock:
+            for (publisher, name), (expected, received, lost) in self._streams.items():
+                total = totals.setdefault(publisher, {'received' : 0, 'lost' : 0})
+                total['received'] += received
+                total['lost'] += lost
+        return totals
+        
+    @property
+    def lost(self):
+        """Total records lost, across all publishers."""
+        return sum(state['lost'] for state in self.loss().values())
+        
+    def report(self):
+        """Report loss and latency as a list of lines of text."""
+        lines = ["Latency:"]
+        with self._lock:
+            for percent in (50, 90, 99):
+                latency = self.latency.percentile(percent)
+                if latency is not None:
+                    lines.append("  p{0:<9d} {1:10.1f} ms".format(percent, latency * 1e3))
+        lines.append("Loss by publisher:")
+        for publisher, state in sorted(self.loss().items()):
+            total = state['received'] + state['lost']
+            lines.append("  {0:<50s} {1:10d} lost ({2:.2%})".format(publisher, state['lost'], float(state['lost']) / total))
+        return lines
+    
+
+class StreamStats(object):
+    """Throughput and top-talker statistics for a stream of log records.
+    
+    Instances are attached as observers to a
+    :class:`~lumberjack.watcher.RecordDecoder`, and are safe to share
+    between watchers. Loss and latency are tracked by ``delivery``, a
+    :class:`DeliveryTracker`.
+    """
+    
+    def __init__(self, window=10.0, capacity=256, maxsources=64):
+        super(StreamStats, self).__init__()
+        self.window = window
+        self.maxsources = maxsources
+        self.records = WindowCounter(window)
+        self.levels = {}
+        self.names = HeavyHitters(capacity, window)
+        self.sites = HeavyHitters(capacity, window)
+        self.sources = collections.OrderedDict()
+        self.delivery = DeliveryTracker()
+        self._lock = threading.Lock()
+        
+    def observe(self, record, size, source=None):
+        """Count a single record of size bytes, received from source."""
+        now = time.time()
+        with self._lock:
+            self.records.add(1, now)
+            levels = self.levels.get(record.levelname)
+            if levels is None:
+                levels = self.levels[record.levelname] = WindowCounter(self.window)
+            levels.add(1, now)
+            self.names.add(record.name, now)
+            self.sites.add((record.pathname, record.lineno), now)
+            
+            sizes = self.sources.get(source)
+            if sizes is None:
+                if len(self.sources) >= self.maxsources:
+                    self.sources.popitem(last=False)
+                sizes = self.sources[source] = WindowCounter(self.window)
+            sizes.add(size, now)
+        self.delivery.observe(record)
+        
+    def report(self, n=10):
+        """Report statistics as a list of lines of text."""
+        now = time.time()
+        with self._lock:
+            lines = ["Records: {0:.1f}/s".format(self.records.rate(now))]
+            for levelname, levels in sorted(self.levels.items()):
+                lines.append("  {0:<10s} {1:10.1f}/s".format(levelname, levels.rate(now)))
+            lines.append("Top loggers:")
+            for name, count in self.names.top(n, now):
+                lines.append("  {0:<50s} {1:10.1f}/s".format(name, count / self.window))
+            lines.append("Top call sites:")
+            for (pathname, lineno), count in self.sites.top(n, now):
+                site = "{0}:{1}".format(pathname, lineno)
+                lines.append("  {0:<50s} {1:10.1f}/s".format(site, count / self.window))
+            lines.append("Bytes by source:")
+            for source, sizes in self.sources.items():
+                lines.append("  {0:<50s} {1:10.1f} kB/s".format(str(source), sizes.rate(now) / 1024.0))
+        lines.extend(self.delivery.report())
+        return lines
+    
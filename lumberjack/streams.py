@@ -3,6 +3,7 @@
 Lumberjack utilities for logging to streams.
 """
 
+import os
 import logging
 import types
 import sys # Default streams.
@@ -106,6 +107,7 @@ class SplitStreamHandler(logging.StreamHandler, object):
         super(SplitStreamHandler, self).__init__()
         del self.stream
         self._ttyraw = False
+        self._autoflush = True
         
     def flush(self):
         """
@@ -151,7 +153,8 @@ class SplitStreamHandler(logging.StreamHandler, object):
                         stream.write(fs % msg)
                 except UnicodeError:
                     stream.write(fs % msg.encode("UTF-8"))
-            self.flush()
+            if self._autoflush:
+                self.flush()
         except (KeyboardInterrupt, SystemExit):
             raise
         except:
@@ -179,7 +182,7 @@ class SplitStreamHandler(logging.StreamHandler, object):
                 # so as to print the calling context.
                 frame = tb.tb_frame
                 while (frame and os.path.dirname(frame.f_code.co_filename) ==
-                       __path__[0]):
+                       os.path.dirname(logging.__file__)):
                     frame = frame.f_back
                 if frame:
                     traceback.print_stack(frame, file=sys.stderr)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Fire-and-forget log shipping over UDP, with no dependencies beyond the
+standard library.
+
+Each datagram starts with a header of the publisher ID, a sequence
+number and the number of records it holds, followed by each serialized
+record with a length prefix.
+"""
+
+from __future__ import absolute_import
+
+import os
+import six
+import errno
+import socket
+import select
+import struct
+import threading
+import collections
+
+from six.moves.urllib.parse import urlparse, parse_qs
+
+from .serialize import serializers
+from .watcher import RecordDecoder, LoggerCache
+from .publisher import Publisher
+
+__all__ = ['UDPPublisher', 'UDPLogWatcher']
+
+_header = struct.Struct(">8sQH")
+_prefix = struct.Struct(">H")
+
+#: The largest payload which fits in a UDP datagram.
+MAX_DATAGRAM = 65507
+
+def _resolve(address):
+    """Resolve an address as a (host, port) tuple, 'host:port' or 'udp://host:port'."""
+    if isinstance(address, six.string_types):
+        if "//" not in address:
+            address = "udp://" + address
+        result = urlparse(address)
+        address = (result.hostname or "", result.port)
+    host, port = address
+    family, _, _, _, sockaddr = socket.getaddrinfo(host or None, port, 0, socket.SOCK_DGRAM, 0, socket.AI_PASSIVE)[0]
+    return family, sockaddr
+
+class UDPPublisher(Publisher):
+    """A handler which ships log records over UDP, and never blocks.
+    
+    Records are packed into datagrams of at most ``mtu`` bytes, which are
+    sent when full, or every ``interval`` seconds. Datagrams which can't
+    be sent immediately are dropped, and counted in ``dropped``.
+    
+    The socket and flushing thread are created with the first record.
+    After a fork, the child discards records buffered by the parent (the
+    parent still sends them), starts a new publisher ID and sequence, and
+    creates its own socket and thread if it logs.
+    """
+    
+    def __init__(self, address, mtu=1400, interval=0.1):
+        super(UDPPublisher, self).__init__()
+        self._family, self.address = _resolve(address)
+        self.mtu = mtu
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._reset()
+        
+    def _reset(self):
+        """Reset the publisher ID, sequence and buffer, and forget the socket."""
+        self.socket = None
+        self.id = os.urandom(8)
+        self.sent = 0
+        self.dropped = 0
+        self._sequence = 0
+        self._buffer = []
+        self._size = _header.size
+        
+    def _start(self):
+        """Create the socket and flushing thread."""
+        self.socket = socket.socket(self._family, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        flusher = threading.Thread(target=self._flush_periodically, name="UDPPublisher-flush")
+        flusher.daemon = True
+        flusher.start()
+        
+    def _after_fork(self):
+        """Start afresh in the child process. The parent's socket is left
+        for the parent, and a new one is made on the next record."""
+        super(UDPPublisher, self)._after_fork()
+        self._reset()
+        
+    def emit(self, record):
+        """Add a record to the current datagram."""
+        try:
+            if self.socket is None:
+                if self._stopped.is_set():
+                    return
+                self._start()
+            msg = self.format(record)
+            if isinstance(msg, six.text_type):
+                msg = msg.encode('utf-8')
+            size = _prefix.size + len(msg)
+            if _header.size + size > MAX_DATAGRAM:
+                raise ValueError("Record of {0:d} bytes is too large for a UDP datagram.".format(len(msg)))
+            if self._size + size > self.mtu:
+                self._send()
+            self._buffer.append(msg)
+            self._size += size
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+        
+    def _send(self):
+        """Send the current datagram. The handler lock must be held."""
+        if not self._buffer or self.socket is None:
+            return
+        parts = [_header.pack(self.id, self._sequence, len(self._buffer))]
+        for msg in self._buffer:
+            parts.append(_prefix.pack(len(msg)))
+            parts.append(msg)
+        self._sequence = (self._sequence + 1) & 0xFFFFFFFFFFFFFFFF
+        self._buffer = []
+        self._size = _header.size
+        try:
+            self.socket.sendto(b"".join(parts), self.address)
+        except socket.error:
+            self.dropped += 1
+        else:
+            self.sent += 1
+        
+    def flush(self):
+        """Send any buffered records."""
+        self.acquire()
+        try:
+            self._send()
+        finally:
+            self.release()
+        
+    def _flush_periodically(self):
+        """Flush buffered records every interval."""
+        while not self._stopped.wait(self.interval):
+            self.flush()
+        
+    def close(self):
+        """Flush and close the UDP publisher."""
+        self._stopped.set()
+        self.flush()
+        if self.socket is not None:
+            self.socket.close()
+        super(UDPPublisher, self).close()
+    
+
+class UDPLogWatcher(threading.Thread, object):
+    """A UDP log watcher, which binds to an address and receives records
+    from any number of :class:`UDPPublisher` instances.
+    
+    Lost datagrams are detected from gaps in each publisher's sequence
+    numbers, and counted in ``lost``. Datagrams which can't be decoded or
+    handled are counted in ``errors``, and don't stop the watcher.
+    
+    Anyone who can reach the port can send datagrams, so the pickle
+    serializer (which can run arbitrary code) is refused.
+    """
+    
+    @classmethod
+    def from_url(cls, url):
+        """Make a log watcher with a URL. Without a host, only the loopback
+        interface is bound; use ``udp://0.0.0.0:port`` to listen on all."""
+        result = urlparse(url)
+        options = parse_qs(result.query)
+        serializer = serializers[options.get("serialize", ["json"])[0]]
+        return cls((result.hostname or "localhost", result.port), serializer.deserialize)
+    
+    def __init__(self, address, deserialize="json", maxpublishers=1024):
+        super(UDPLogWatcher, self).__init__()
+        if deserialize == "pickle" or deserialize == serializers['pickle'].deserialize:
+            raise ValueError("Pickle can't be used over UDP, as it would run code from any sender.")
+        self.daemon = True
+        family, sockaddr = _resolve(address)
+        self.socket = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        except socket.error:
+            pass
+        self.socket.bind(sockaddr)
+        self.socket.setblocking(False)
+        self.address = self.socket.getsockname()
+        
+        self.decoder = RecordDecoder(deserialize, source="udp://{0}:{1}".format(*self.address[:2]))
+        self.loggers = LoggerCache()
+        self.dispatch = self.loggers.handle
+        self.received = 0
+        self.lost = 0
+        self.errors = 0
+        self.maxpublishers = maxpublishers
+        self._expected = collections.OrderedDict()
+        self._subscriptions = []
+        self._shouldrun = threading.Event()
+        
+    def subscribe(self, name):
+        """Subscribe to records from loggers starting with name."""
+        self._subscriptions.append(name)
+        
+    def start(self):
+        """Start the thread."""
+        self._shouldrun.set()
+        super(UDPLogWatcher, self).start()
+        
+    def stop(self):
+        """Stop this thread."""
+        self._shouldrun.clear()
+        
+    def _track(self, sender, publisher, sequence):
+        """Track sequence numbers to count lost datagrams."""
+        key = (sender, publisher)
+        expected = self._expected.pop(key, None)
+        if expected is not None and sequence > expected:
+            self.lost += sequence - expected
+        if len(self._expected) >= self.maxpublishers:
+            self._expected.popitem(last=False)
+        self._expected[key] = max(sequence + 1, expected or 0)
+        
+    def _handle_datagram(self, datagram, sender):
+        """Unpack and handle the records in one datagram."""
+        publisher, sequence, count = _header.unpack_from(datagram)
+        self.received += 1
+        self._track(sender, publisher, sequence)
+        offset = _header.size
+        for i in range(count):
+            size, = _prefix.unpack_from(datagram, offset)
+            offset += _prefix.size
+            record = self.decoder(datagram[offset:offset + size])
+            offset += size
+            if any(record.name.startswith(name) for name in self._subscriptions):
+                self.dispatch(record)
+        
+    def run(self):
+        """Run the log watcher, draining every waiting datagram on each wakeup."""
+        while self._shouldrun.isSet():
+            ready, _, _ = select.select([self.socket], [], [], 0.1)
+            while ready:
+                try:
+                    datagram, sender = self.socket.recvfrom(65535)
+                except socket.error as e:
+                    if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        break
+                    raise
+                try:
+                    self._handle_datagram(datagram, sender)
+                except Exception:
+                    self.errors += 1
+        self.socket.close()
+        
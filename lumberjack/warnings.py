@@ -2,25 +2,102 @@
 
 from __future__ import absolute_import
 
+import time
+import atexit
 import logging
 import warnings
+import threading
+import collections
 
 def showwarning_lumberjack(message, category, filename, lineno, line=None, file=None):
     """Adjust warnings formatting."""
     logging.getLogger("py.warnings").warning("{0} [{1}]".format(message, category.__name__), extra={'category':category.__name__})
     
+class WarningAggregator(object):
+    """A replacement for showwarning which aggregates repeated warnings.
+    
+    Warnings are counted per (category, filename, lineno) in a table of at
+    most ``maxsize`` entries. The first occurrence is logged right away.
+    After that, warnings which have repeated are summarized with their
+    counts at most every ``interval`` seconds, and when :meth:`summarize`
+    is called (e.g. at interpreter exit).
+    """
+    
+    def __init__(self, interval=60.0, maxsize=1000):
+        super(WarningAggregator, self).__init__()
+        self.interval = interval
+        self.maxsize = maxsize
+        self._table = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._summarized = time.time()
+        
+    def __call__(self, message, category, filename, lineno, line=None, file=None):
+        """Count a warning, logging it if it is new."""
+        key = (category, filename, lineno)
+        evicted = None
+        with self._lock:
+            entry = self._table.get(key)
+            if entry is None:
+                if len(self._table) >= self.maxsize:
+                    evicted = self._table.popitem(last=False)
+                self._table[key] = [message, 1, 0]
+            else:
+                entry[1] += 1
+                entry[2] += 1
+            due = time.time() - self._summarized >= self.interval
+        if entry is None:
+            showwarning_lumberjack(message, category, filename, lineno)
+        if evicted is not None:
+            self._log_summary(evicted[0], evicted[1])
+        if due:
+            self.summarize()
+        
+    def _log_summary(self, key, entry):
+        """Log a summary for a single table entry."""
+        (category, filename, lineno), (message, total, repeats) = key, entry
+        if repeats:
+            logging.getLogger("py.warnings").warning("{0} [{1}] repeated {2:d} times ({3:d} in total) at {4}:{5}".format(
+                message, category.__name__, repeats, total, filename, lineno),
+                extra={'category':category.__name__, 'count':repeats})
+        
+    def summarize(self):
+        """Log a summary of every warning which has repeated since the last summary."""
+        with self._lock:
+            self._summarized = time.time()
+            summaries = [(key, list(entry)) for key, entry in self._table.items() if entry[2]]
+            for key, entry in summaries:
+                self._table[key][2] = 0
+        for key, entry in summaries:
+            self._log_summary(key, entry)
+    
 _showwarning_original = None
-def captureWarnings(capture=False):
-    """Set up the warnings logger"""
-    global _showwarning_original
+_aggregator = None
+def captureWarnings(capture=False, aggregate=False, interval=60.0, maxsize=1000):
+    """Set up the warnings logger
+    
+    With ``aggregate=True``, repeated warnings are counted by a
+    :class:`WarningAggregator` and logged as periodic summaries.
+    """
+    global _showwarning_original, _aggregator
     if capture:
         if _showwarning_original is None:
             warnings_logger = logging.getLogger("py.warnings")
             if not warnings_logger.handlers and hasattr(logging, 'NullHandler'):
                 warnings_logger.addHandler(logging.NullHandler())
             _showwarning_original = warnings.showwarning
+        if aggregate:
+            if _aggregator is None:
+                _aggregator = WarningAggregator(interval, maxsize)
+                atexit.register(_aggregator.summarize)
+            warnings.showwarning = _aggregator
+        else:
             warnings.showwarning = showwarning_lumberjack
     else:
         if _showwarning_original is not None:
             warnings.showwarning = _showwarning_original
             _showwarning_original = None
+        if _aggregator is not None:
+            _aggregator.summarize()
+            if hasattr(atexit, 'unregister'):
+                atexit.unregister(_aggregator.summarize)
+            _aggregator = None
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+A watchdog for slow handlers, which moves them off the logging thread
+while they are slow.
+"""
+
+import time
+import logging
+import threading
+
+from six.moves import queue
+
+__all__ = ['WatchdogHandler', 'install']
+
+class WatchdogHandler(logging.Handler, object):
+    """A handler which watches the latency of a wrapped handler.
+    
+    Records are handed straight to the target handler, and the time each
+    one takes is tracked as a moving average. When the average rises past
+    ``threshold`` seconds, records are instead put on a bounded queue of
+    ``maxqueue`` records and handled on a background thread, which keeps
+    measuring. Once the average falls below ``recovery`` seconds and the
+    queue has drained, records go straight to the target again. Records
+    which don't fit on the queue are dropped, and counted in ``dropped``.
+    Each switch is logged to the ``lumberjack.watchdog`` logger.
+    
+    A handler which stalls never returns, so it can't be measured. Each
+    direct call's start time is kept while it is in progress, and if one
+    has taken longer than ``threshold`` when the next record arrives, the
+    target is offloaded at once. The stalled caller stays blocked, but
+    other callers no longer wait on it.
+    """
+    
+    def __init__(self, target, threshold=0.01, recovery=None, alpha=0.1, maxqueue=10000):
+        super(WatchdogHandler, self).__init__(target.level)
+        self.target = target
+        self.threshold = threshold
+        self.recovery = recovery if recovery is not None else threshold / 2.0
+        self.alpha = alpha
+        self.latency = 0.0
+        self.offloaded = False
+        self.dropped = 0
+        self._queue = queue.Queue(maxqueue)
+        self._worker = None
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        
+    def _measure(self, start):
+        """Update the moving average latency with a call started at start."""
+        self.latency += self.alpha * ((time.time() - start) - self.latency)
+        
+    def _stalled(self, now):
+        """The time taken so far by the oldest direct call still in progress."""
+        with self._inflight_lock:
+            if not self._inflight:
+                return 0.0
+            return now - min(self._inflight.values())
+        
+    def _offload(self, latency):
+        """Switch the target handler to the background queue."""
+        self.acquire()
+        try:
+            if self.offloaded:
+                return
+            self.offloaded = True
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work, name="WatchdogHandler")
+                self._worker.daemon = True
+                self._worker.start()
+        finally:
+            self.release()
+        logging.getLogger("lumberjack.watchdog").warning(
+            "{0} is slow ({1:.1f} ms per record), moving it to a background queue.".format(type(self.target).__name__, latency * 1e3))
+        
+    def _restore(self):
+        """Switch the target handler back to the logging thread."""
+        self.offloaded = False
+        logging.getLogger("lumberjack.watchdog").info(
+            "{0} has recovered ({1:.1f} ms per record), moving it back from the background queue.".format(type(self.target).__name__, self.latency * 1e3))
+        
+    def _work(self):
+        """Handle queued records in the background."""
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            start = time.time()
+            try:
+                self.target.handle(record)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                self.handleError(record)
+            finally:
+                self._measure(start)
+            if self.offloaded and self.latency < self.recovery and self._queue.empty():
+                self._restore()
+        
+    def handle(self, record):
+        """Filter a record, and emit it. The target handler does its own locking."""
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+        
+    def _enqueue(self, record):
+        """Put a record on the background queue, or drop it if the queue is full."""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        
+    def emit(self, record):
+        """Hand a record to the target handler, directly or through the queue.
+        
+        Each direct call is tracked by its own token, since a target may
+        log (and so re-enter this handler) on the same thread.
+        """
+        try:
+            if self.offloaded:
+                self._enqueue(record)
+                return
+            start = time.time()
+            stalled = self._stalled(start)
+            if stalled > self.threshold:
+                self._offload(stalled)
+                self._enqueue(record)
+                return
+            token = object()
+            with self._inflight_lock:
+                self._inflight[token] = start
+            try:
+                self.target.handle(record)
+            finally:
+                with self._inflight_lock:
+                    del self._inflight[token]
+                self._measure(start)
+            if self.latency > self.threshold:
+                self._offload(self.latency)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+        
+    def flush(self):
+        """Flush the target handler."""
+        self.target.flush()
+        
+    def close(self):
+        """Drain the queue, and close the target handler."""
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+            self._worker = None
+        self.target.close()
+        super(WatchdogHandler, self).close()
+    
+
+def install(logger=None, threshold=0.01, **kwargs):
+    """Wrap every handler on a logger (by default, the root logger) in a
+    :class:`WatchdogHandler`."""
+    if logger is None or isinstance(logger, str):
+        logger = logging.getLogger(logger)
+    for handler in list(logger.handlers):
+        if isinstance(handler, WatchdogHandler):
+            continue
+        logger.removeHandler(handler)
+        logger.addHandler(WatchdogHandler(handler, threshold, **kwargs))
+    
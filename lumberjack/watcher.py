@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Shared machinery for log watchers, which turn messages received from
+a publisher back into log records.
+"""
+
+import six
+import time
+import heapq
+import logging
+import itertools
+import threading
+import collections
+
+from .serialize import serializers, TracebackCache, StringTableDecoder
+
+__all__ = ['RecordDecoder', 'LoggerCache', 'MergeStage']
+
+class RecordDecoder(object):
+    """Decode messages into log records, undoing any stateful encoding
+    applied by the publisher.
+    
+    One decoder should be used per stream, as it keeps state (e.g. the
+    traceback cache and string tables) between messages.
+    
+    Observers (e.g. :class:`~lumberjack.stats.StreamStats`) are called
+    with each decoded record, the size of the message in bytes, and the
+    source of the stream.
+    
+    A decoder may be shared by several watcher threads (e.g. one per
+    shard), so restoring state and calling observers is serialized with
+    a lock.
+    """
+    
+    def __init__(self, deserialize="json", source=None):
+        super(RecordDecoder, self).__init__()
+        self.source = source
+        self.observers = []
+        if deserialize is None:
+            self.deserialize = logging.makeLogRecord
+        elif isinstance(deserialize, six.string_types):
+            self.deserialize = serializers[deserialize].deserialize
+        else:
+            self.deserialize = deserialize
+        self.strings = StringTableDecoder()
+        self.tracebacks = TracebackCache()
+        self._lock = threading.Lock()
+        
+    def __call__(self, msg):
+        """Decode a single message into a log record."""
+        record = self.deserialize(msg)
+        with self._lock:
+            self.strings.restore(record)
+            self.tracebacks.restore(record)
+            for observer in self.observers:
+                observer.observe(record, len(msg), self.source)
+        return record
+        
+
+class LoggerCache(dict):
+    """A cache of loggers by name.
+    
+    ``logging.getLogger`` takes the logging module lock on every call, so
+    watchers look loggers up here instead.
+    """
+    
+    def __missing__(self, name):
+        logger = self[name] = logging.getLogger(name)
+        return logger
+        
+    def handle(self, record):
+        """Handle a record with the logger named for it."""
+        self[record.name].handle(record)
+    
+
+class MergeStage(threading.Thread, object):
+    """Merge records from several sources into creation-time order.
+    
+    Records are buffered per source (the source given to :meth:`push`,
+    and the publisher ID stamped on the record, if any), and released in order
+    of ``record.created`` by a k-way merge over the head of each source's
+    buffer, which costs O(log k) per record for k sources.
+    
+    Each record is held for at most ``window`` seconds, and at most
+    ``maxrecords`` records are held at once. Records created before the
+    last released record are late: they are released immediately, and
+    counted in ``late``.
+    
+    Use :meth:`push`, with the watcher's source, as each watcher's
+    ``dispatch``, and start the stage to release records to its own
+    ``dispatch``. Records without a stamped publisher ID (e.g. over UDP,
+    or from capture files) can only be told apart by their source.
+    """
+    
+    def __init__(self, window=0.5, maxrecords=10000, dispatch=None):
+        super(MergeStage, self).__init__()
+        self.daemon = True
+        self.window = window
+        self.maxrecords = maxrecords
+        self.dispatch = dispatch if dispatch is not None else LoggerCache().handle
+        self.late = 0
+        self.released = 0
+        self._queues = {}
+        self._heap = []
+        self._count = 0
+        self._tiebreak = itertools.count()
+        self._watermark = float('-inf')
+        self._condition = threading.Condition()
+        self._shouldrun = threading.Event()
+        
+    def push(self, record, source=None):
+        """Buffer a record for merging."""
+        source = (source, getattr(record, 'publisher_id', None))
+        now = time.time()
+        with self._condition:
+            late = record.created < self._watermark
+            if late:
+                self.late += 1
+            else:
+                queue = self._queues.get(source)
+                if queue is None:
+                    queue = self._queues[source] = collections.deque()
+                if not queue:
+                    heapq.heappush(self._heap, (record.created, next(self._tiebreak), source))
+                queue.append((min(record.created, now) + self.window, record))
+                self._count += 1
+                self._condition.notify()
+        if late:
+            self.dispatch(record)
+        
+    def _release(self, now):
+        """Pop every record which is ready for release. The condition must be held."""
+        ready = []
+        while self._heap:
+            created, _, source = self._heap[0]
+            queue = self._queues[source]
+            deadline, record = queue[0]
+            if deadline > now and self._count <= self.maxrecords:
+                return ready, deadline - now
+            heapq.heappop(self._heap)
+            queue.popleft()
+            self._count -= 1
+            if queue:
+                heapq.heappush(self._heap, (queue[0][1].created, next(self._tiebreak), source))
+            else:
+                del self._queues[source]
+            if record.created < self._watermark:
+                self.late += 1
+            else:
+                self._watermark = record.created
+            ready.append(record)
+        return ready, None
+        
+    def start(self):
+        """Start releasing records."""
+        self._shouldrun.set()
+        super(MergeStage, self).start()
+        
+    def stop(self):
+        """Stop releasing records, releasing anything still buffered."""
+        self._shouldrun.clear()
+        with self._condition:
+            self._condition.notify()
+        
+    def run(self):
+        """Release records as they become ready."""
+        while True:
+            with self._condition:
+                running = self._shouldrun.isSet()
+                ready, timeout = self._release(time.time() if running else float('inf'))
+                if not ready:
+                    if not running:
+                        return
+                    self._condition.wait(timeout if timeout is not None else 0.1)
+                    continue
+            self.released += len(ready)
+            for record in ready:
+                self.dispatch(record)
+    
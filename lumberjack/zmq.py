@@ -7,41 +7,86 @@ from __future__ import print_function, absolute_import
 
 import sys
 import six
-import logging
 import threading
 import collections
 
 from six.moves.urllib.parse import urlparse, parse_qs, urlunparse
 
 from .serialize import serializers
+from .watcher import RecordDecoder, LoggerCache
+from .publisher import Publisher
 
 try:
     import zmq
 except ImportError as e:
     print("The python bindings for ZMQ are required to use lumberjack.zmq\nPlease install pyzmq.", file=sys.stderr)
 
-class ZMQPublisher(logging.Handler, object):
+#: Sockets and contexts inherited from a parent process. These must not be
+#: closed (or garbage collected, which closes them) in the child.
+_abandoned = []
+
+class ZMQPublisher(Publisher):
     """A handler which publishes log messages to a ZMQ socket.
     
     The logger name is used as the topic selector for publishing.
+    
+    After a fork, the child abandons the parent's socket and context, and
+    creates its own on the next record. Only one process can bind an
+    address, so a publisher which binds is disabled in forked children,
+    with a single warning. Forked children should connect (e.g. to a
+    ``lumberjack-broker``) rather than bind.
     """
     def __init__(self, interface_or_socket, context=None, bind=False):
         super(ZMQPublisher, self).__init__()
         if isinstance(interface_or_socket, zmq.Socket):
             self.socket = interface_or_socket
             self.ctx = self.socket.context
+            self._interface = self.socket.getsockopt(zmq.LAST_ENDPOINT)
         else:
             self.ctx = context or zmq.Context()
-            self.socket = self.ctx.socket(zmq.PUB)
-            if bind:
-                self.socket.bind(interface_or_socket)
-            else:
-                self.socket.connect(interface_or_socket)
+            self.socket = None
+            self._interface = interface_or_socket
+        self._bind = bind
+        self._disabled = False
+        self._warned = False
+        if self.socket is None:
+            self._connect()
+        
+    def _connect(self):
+        """Create the PUB socket, and bind or connect it."""
+        if not self._interface:
+            raise ValueError("Can't recreate a ZMQ socket without a known endpoint.")
+        if self.ctx is None:
+            self.ctx = zmq.Context()
+        self.socket = self.ctx.socket(zmq.PUB)
+        if self._bind:
+            self.socket.bind(self._interface)
+        else:
+            self.socket.connect(self._interface)
+        
+    def _after_fork(self):
+        """Abandon the parent's socket and context. New ones are made on
+        the next record, unless this publisher binds, as the parent still
+        owns the address."""
+        super(ZMQPublisher, self)._after_fork()
+        _abandoned.append((self.ctx, self.socket))
+        self.ctx = None
+        self.socket = None
+        if self._bind:
+            self._disabled = True
         
     def emit(self, record):
         """Emit a record over the ZMQ socket."""
+        if self._disabled:
+            if not self._warned:
+                self._warned = True
+                print("lumberjack: ZMQPublisher bound to {0} can't publish from forked process {1:d}. "
+                      "Connect to a lumberjack-broker instead.".format(self._interface, self._pid), file=sys.stderr)
+            return
         try:
-            msg = self.format(record)
+            if self.socket is None:
+                self._connect()
+            msg = self.format(record, self.stamp(record))
             name = record.name
             if isinstance(msg, six.text_type):
                 msg = msg.encode('utf-8')
@@ -56,7 +101,9 @@ class ZMQPublisher(logging.Handler, object):
         
     def close(self):
         """Close the ZMQ publisher."""
-        self.socket.close()
+        if self.socket is not None:
+            self.socket.close()
+        super(ZMQPublisher, self).close()
         
     
 
@@ -70,8 +117,8 @@ class ZMQLogWatcher(threading.Thread, object):
         # Get the options out of the URL.
         result = urlparse(url)
         options = parse_qs(result.query)
-        channel = options.get("channel", "")
-        serializer = serializers[options.get("serialize", "json")]
+        channel = options.get("channel", [""])[0]
+        serializer = serializers[options.get("serialize", ["json"])[0]]
         
         # Rebuild the URL without the query string.
         args = list(result)
@@ -79,7 +126,7 @@ class ZMQLogWatcher(threading.Thread, object):
         url = urlunparse(args)
         
         # Set up the object.
-        obj = cls(url, channel, serializer.deserialize)
+        obj = cls(url, deserialize=serializer.deserialize)
         obj.subscribe(channel)
         return obj
     
@@ -93,12 +140,10 @@ class ZMQLogWatcher(threading.Thread, object):
             self.socket = self.ctx.socket(zmq.SUB)
             self.socket.connect(interface_or_socket)
         
-        if deserialize is None:
-            self.deserialize = logging.makeLogRecord
-        elif isinstance(deserialize, six.string_types):
-            self.deserialize = serializers[deserialize].deserialize
-        else:
-            self.deserialize = deserialize
+        source = interface_or_socket if isinstance(interface_or_socket, six.string_types) else None
+        self.decoder = RecordDecoder(deserialize, source=source)
+        self.loggers = LoggerCache()
+        self.dispatch = self.loggers.handle
         
         self._sockopts = collections.deque()
         
@@ -115,7 +160,7 @@ class ZMQLogWatcher(threading.Thread, object):
     
     def stop(self):
         """Stop this thread."""
-        if not self.isAlive():
+        if not self.is_alive():
             return
         if not self._shouldrun.isSet():
             return
@@ -141,7 +186,9 @@ class ZMQLogWatcher(threading.Thread, object):
         super(ZMQLogWatcher, self).start()
     
     def subscribe(self, name):
-        """Subscribe to a channel."""
+        """Subscribe to a channel, i.e. a logger name prefix."""
+        if isinstance(name, six.text_type):
+            name = name.encode('utf-8')
         self.setsockopt(zmq.SUBSCRIBE, name)
     
     def setsockopt(self, key, name):
@@ -165,6 +212,6 @@ class ZMQLogWatcher(threading.Thread, object):
                 continue
             if self.socket in ready:
                 name, msg = self.socket.recv_multipart()
-                record = self.deserialize(msg)
-                logging.getLogger(name).handle(record)
+                record = self.decoder(msg)
+                self.dispatch(record)
             
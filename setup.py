@@ -30,6 +30,8 @@ setup(name="lumberjack-logging",
       package_data = {'lumberjack.config' : ['*.cfg'] },
       entry_points={
           'console_scripts':
-          ['lumberjack-listen = lumberjack.listener:main']
+          ['lumberjack-listen = lumberjack.listener:main',
+           'lumberjack-broker = lumberjack.broker:main',
+           'lumberjack-replay = lumberjack.replay:main']
       },
       )
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the REDIS log watcher, against a local redis-server.
+
+The tests are skipped when redis-server is not installed. Set
+LUMBERJACK_TEST_REDIS_URL to use an already running server instead.
+"""
+
+import os
+import time
+import socket
+import shutil
+import logging
+import threading
+import subprocess
+
+import pytest
+
+redis = pytest.importorskip("redis")
+
+from lumberjack.redis import REDISLogWatcher, REDISPublisher
+from lumberjack.serialize import JSONFormatter
+
+def _free_port():
+    """Find a free TCP port on localhost."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+@pytest.fixture(scope="module")
+def redis_url():
+    """The URL of a REDIS server, started for these tests if necessary."""
+    url = os.environ.get("LUMBERJACK_TEST_REDIS_URL")
+    if url:
+        yield url
+        return
+    executable = shutil.which("redis-server")
+    if executable is None:
+        pytest.skip("redis-server is not installed.")
+    port = _free_port()
+    process = subprocess.Popen([executable, "--port", str(port), "--bind", "127.0.0.1",
+                                "--save", "", "--appendonly", "no"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = "redis://127.0.0.1:{0:d}/0".format(port)
+    client = redis.StrictRedis.from_url(url)
+    try:
+        deadline = time.time() + 5.0
+        while True:
+            try:
+                client.ping()
+                break
+            except redis.ConnectionError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+        yield url
+    finally:
+        client.close()
+        process.terminate()
+        process.wait()
+
+class Collector(object):
+    """Collect dispatched records, and wait for them to arrive."""
+
+    def __init__(self):
+        self.records = []
+        self.condition = threading.Condition()
+
+    def __call__(self, record):
+        with self.condition:
+            self.records.append(record)
+            self.condition.notify_all()
+
+    def messages(self):
+        return [record.getMessage() for record in self.records if record.name != "sync"]
+
+    def wait(self, count, timeout=5.0):
+        """Wait until at least count records (other than sync records) arrive."""
+        deadline = time.time() + timeout
+        with self.condition:
+            while len(self.messages()) < count and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+        return self.messages()
+
+
+def _record(msg, name="test"):
+    return logging.makeLogRecord(dict(name=name, msg=msg, levelno=logging.INFO, levelname="INFO"))
+
+def _publisher(redis_url, channel):
+    publisher = REDISPublisher(redis_url, channel)
+    publisher.setFormatter(JSONFormatter())
+    return publisher
+
+def _sync(publisher, collector, timeout=5.0):
+    """Publish sync records until one arrives, so the watcher is subscribed."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        publisher.handle(_record("sync", name="sync"))
+        with collector.condition:
+            if any(record.name == "sync" for record in collector.records):
+                return
+            collector.condition.wait(0.05)
+    raise AssertionError("The watcher never subscribed.")
+
+@pytest.fixture
+def watcher(redis_url):
+    """A running watcher, with its records collected."""
+    watcher = REDISLogWatcher(redis_url, "logging", deserialize=JSONFormatter.deserialize)
+    watcher.dispatch = Collector()
+    watcher.start()
+    yield watcher
+    watcher.stop()
+    watcher.join(5.0)
+
+def test_blocking_loop_delivers_promptly(redis_url, watcher):
+    publisher = _publisher(redis_url, "logging")
+    _sync(publisher, watcher.dispatch)
+
+    # The watcher blocks for up to 10 s, so prompt delivery means it is
+    # woken by the message rather than polling.
+    start = time.time()
+    publisher.handle(_record("hello"))
+    assert watcher.dispatch.wait(1) == ["hello"]
+    assert time.time() - start < 0.5
+
+def test_batched_drain(redis_url, watcher):
+    publisher = _publisher(redis_url, "logging")
+    _sync(publisher, watcher.dispatch)
+
+    expected = ["message {0:d}".format(i) for i in range(500)]
+    for msg in expected:
+        publisher.handle(_record(msg))
+    assert watcher.dispatch.wait(len(expected)) == expected
+
+def test_psubscribe(redis_url):
+    watcher = REDISLogWatcher(redis_url, deserialize=JSONFormatter.deserialize)
+    watcher.dispatch = Collector()
+    watcher.psubscribe("logging.*")
+    watcher.start()
+    try:
+        publisher = _publisher(redis_url, "logging.app")
+        _sync(publisher, watcher.dispatch)
+        publisher.handle(_record("matched"))
+        _publisher(redis_url, "other").handle(_record("unmatched"))
+        _publisher(redis_url, "logging.db").handle(_record("also matched"))
+        assert watcher.dispatch.wait(2) == ["matched", "also matched"]
+    finally:
+        watcher.stop()
+        watcher.join(5.0)
+
+def test_subscribe_after_start(redis_url):
+    watcher = REDISLogWatcher(redis_url, deserialize=JSONFormatter.deserialize)
+    watcher.dispatch = Collector()
+    watcher.start()
+    try:
+        time.sleep(0.1)
+        watcher.subscribe("late")
+        publisher = _publisher(redis_url, "late")
+        _sync(publisher, watcher.dispatch)
+        publisher.handle(_record("after start"))
+        assert watcher.dispatch.wait(1) == ["after start"]
+    finally:
+        watcher.stop()
+        watcher.join(5.0)
+
+def test_stop_wakes_the_thread(redis_url):
+    watcher = REDISLogWatcher(redis_url, "logging", timeout=30.0)
+    watcher.start()
+    time.sleep(0.2)
+    start = time.time()
+    watcher.stop()
+    watcher.join(5.0)
+    assert not watcher.is_alive()
+    assert time.time() - start < 2.0
+
+def test_from_url():
+    watcher = REDISLogWatcher.from_url("redis://localhost:6379/0?channel=logs&serialize=json&pattern=app.*&pattern=db.*")
+    assert watcher.channels == set(["logs"])
+    assert watcher.patterns == set(["app.*", "db.*"])
+    assert watcher.decoder.deserialize == JSONFormatter.deserialize
+    kwargs = watcher.client.connection_pool.connection_kwargs
+    assert kwargs['host'] == "localhost"
+    assert kwargs['port'] == 6379
+
+def test_from_url_keeps_db():
+    watcher = REDISLogWatcher.from_url("redis://localhost:6379?db=3&channel=logs")
+    assert watcher.client.connection_pool.connection_kwargs['db'] == 3
+    assert watcher.channels == set(["logs"])
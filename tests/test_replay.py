@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Round-trip tests for capture files.
+"""
+
+import os
+import logging
+
+import pytest
+
+from lumberjack.replay import CaptureHandler, CaptureReader, CaptureLogWatcher, main
+from lumberjack.files import SegmentFileHandler
+
+def _record(msg, args=(), name="app"):
+    return logging.makeLogRecord(dict(name=name, msg=msg, args=args, levelno=logging.INFO, levelname="INFO"))
+
+def _messages(path):
+    reader = CaptureReader.open(path)
+    try:
+        return [record.getMessage() for record in reader.records()]
+    finally:
+        reader.close()
+
+@pytest.mark.parametrize("serializer", ["json", "pickle"])
+def test_capture_round_trip(tmpdir, serializer):
+    path = str(tmpdir.join("app.cap"))
+    handler = CaptureHandler(path, serializer)
+    handler.handle(_record("x %d", (1,)))
+    handler.handle(_record("%s and %s", ("this", "that")))
+    handler.close()
+    assert _messages(path) == ["x 1", "this and that"]
+
+def test_segment_round_trip(tmpdir):
+    path = str(tmpdir.join("app.cap"))
+    handler = SegmentFileHandler(path, "json", compress=False)
+    handler.handle(_record("x %d", (1,)))
+    handler.close()
+    assert _messages(path) == ["x 1"]
+
+def test_replay_to_stream(tmpdir, capsys):
+    path = str(tmpdir.join("app.cap"))
+    handler = CaptureHandler(path)
+    handler.handle(_record("x %d", (1,)))
+    handler.close()
+    assert main(path, "--fast") == 0
+    captured = capsys.readouterr()
+    assert "x 1" in captured.out + captured.err
+    assert "Logging error" not in captured.err
+
+def test_capture_watcher(tmpdir):
+    path = str(tmpdir.join("app.cap"))
+    handler = CaptureHandler(path)
+    handler.handle(_record("x %d", (1,)))
+    handler.handle(_record("other", name="other"))
+    handler.close()
+    records = []
+    watcher = CaptureLogWatcher(path)
+    watcher.dispatch = records.append
+    watcher.subscribe("app")
+    watcher.start()
+    watcher.join(5.0)
+    assert [record.getMessage() for record in records] == ["x 1"]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Round-trip tests for the serializing formatters.
+"""
+
+import logging
+
+from lumberjack.serialize import JSONFormatter, StringTableEncoder
+from lumberjack.watcher import RecordDecoder
+
+def _record(name, msg="message", thread="worker-1"):
+    record = logging.makeLogRecord(dict(name=name, msg=msg, levelno=logging.INFO, levelname="INFO"))
+    record.threadName = thread
+    return record
+
+def test_string_table_round_trip():
+    formatter = JSONFormatter(string_table=True)
+    decoder = RecordDecoder("json")
+    for i in range(20):
+        record = decoder(formatter.format(_record("app.{0:d}".format(i % 3))))
+        assert record.name == "app.{0:d}".format(i % 3)
+        assert record.threadName == "worker-1"
+
+def test_string_table_filtered_by_topic():
+    # A subscriber filtering by topic only sees one logger's records, so
+    # strings first sent on another logger's records must be sent again.
+    formatter = JSONFormatter(string_table=StringTableEncoder(refresh_every=5))
+    decoder = RecordDecoder("json")
+    received = []
+    for i in range(24):
+        name = "app.a" if i % 2 else "app.b"
+        msg = formatter.format(_record(name, thread="worker-{0:d}".format((i // 2) % 3)))
+        if name == "app.a":
+            received.append(decoder(msg))
+    assert len(received) == 12
+    for record in received:
+        assert record.name == "app.a"
+        assert record.threadName.startswith("worker-")
+
+def test_string_table_late_subscriber():
+    formatter = JSONFormatter(string_table=StringTableEncoder(refresh_every=10))
+    for i in range(15):
+        formatter.format(_record("app.a"))
+    decoder = RecordDecoder("json")
+    records = [decoder(formatter.format(_record("app.a"))) for i in range(10)]
+    assert records[-1].name == "app.a"
+    assert records[-1].threadName == "worker-1"
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the UDP transport, on localhost.
+"""
+
+import time
+import socket
+import logging
+import threading
+
+import pytest
+
+from lumberjack.udp import UDPPublisher, UDPLogWatcher, _header, _prefix
+from lumberjack.serialize import JSONFormatter
+
+class Collector(object):
+    """Collect dispatched records, and wait for them to arrive."""
+
+    def __init__(self):
+        self.records = []
+        self.condition = threading.Condition()
+
+    def __call__(self, record):
+        with self.condition:
+            self.records.append(record)
+            self.condition.notify_all()
+
+    def wait(self, count, timeout=5.0):
+        deadline = time.time() + timeout
+        with self.condition:
+            while len(self.records) < count and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+        return [record.getMessage() for record in self.records]
+
+
+def _record(msg, name="app"):
+    return logging.makeLogRecord(dict(name=name, msg=msg, levelno=logging.INFO, levelname="INFO"))
+
+@pytest.fixture
+def watcher():
+    watcher = UDPLogWatcher.from_url("udp://127.0.0.1:0")
+    watcher.dispatch = Collector()
+    watcher.subscribe("")
+    watcher.start()
+    yield watcher
+    watcher.stop()
+    watcher.join(5.0)
+
+@pytest.fixture
+def publisher(watcher):
+    publisher = UDPPublisher(watcher.address[:2], interval=0.01)
+    publisher.setFormatter(JSONFormatter())
+    yield publisher
+    publisher.close()
+
+def _send(sock, watcher, sequence, payloads, publisher_id=b"testtest"):
+    """Send a hand-built datagram to the watcher."""
+    parts = [_header.pack(publisher_id, sequence, len(payloads))]
+    for payload in payloads:
+        parts.append(_prefix.pack(len(payload)))
+        parts.append(payload)
+    sock.sendto(b"".join(parts), watcher.address[:2])
+
+@pytest.fixture
+def sock():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    yield sock
+    sock.close()
+
+def test_round_trip(watcher, publisher):
+    expected = ["message {0:d}".format(i) for i in range(200)]
+    for msg in expected:
+        publisher.handle(_record(msg))
+    publisher.flush()
+    assert watcher.dispatch.wait(len(expected)) == expected
+    assert watcher.lost == 0
+    assert watcher.errors == 0
+    assert watcher.received > 1
+
+def test_sequence_gaps_are_lost(watcher, sock):
+    formatter = JSONFormatter()
+    payload = formatter.format(_record("hello")).encode('utf-8')
+    _send(sock, watcher, 0, [payload])
+    _send(sock, watcher, 3, [payload])
+    assert watcher.dispatch.wait(2) == ["hello", "hello"]
+    assert watcher.lost == 2
+    assert watcher.errors == 0
+
+def test_bad_datagrams_are_errors(watcher, sock):
+    formatter = JSONFormatter()
+    sock.sendto(b"short", watcher.address[:2])
+    _send(sock, watcher, 0, [b"\x80\x04 not json"])
+    _send(sock, watcher, 1, [formatter.format(_record("still running")).encode('utf-8')])
+    assert watcher.dispatch.wait(1) == ["still running"]
+    assert watcher.errors == 2
+    assert watcher.lost == 0
+
+def test_pickle_is_refused():
+    with pytest.raises(ValueError):
+        UDPLogWatcher.from_url("udp://127.0.0.1:0?serialize=pickle")
+
+def test_binds_loopback_by_default():
+    watcher = UDPLogWatcher.from_url("udp://:0")
+    try:
+        assert watcher.address[0] in ("127.0.0.1", "::1")
+    finally:
+        watcher.socket.close()
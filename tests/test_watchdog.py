@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the watchdog handler.
+"""
+
+import logging
+
+from lumberjack.watchdog import WatchdogHandler
+
+def _record(msg, name="app"):
+    return logging.makeLogRecord(dict(name=name, msg=msg, levelno=logging.INFO, levelname="INFO"))
+
+class Target(logging.Handler, object):
+    """A handler which logs through the watchdog while it handles a record."""
+
+    def __init__(self):
+        super(Target, self).__init__()
+        self.watchdog = None
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+        if record.msg == "outer":
+            self.watchdog.handle(_record("inner"))
+
+class Broken(logging.Handler, object):
+    """A handler whose handle method fails."""
+
+    def handle(self, record):
+        raise RuntimeError("broken")
+
+def test_nested_call_on_one_thread():
+    target = Target()
+    watchdog = target.watchdog = WatchdogHandler(target, threshold=60.0)
+    watchdog.handle(_record("outer"))
+    assert target.messages == ["outer", "inner"]
+    assert watchdog._inflight == {}
+    assert not watchdog.offloaded
+
+def test_errors_are_handled(monkeypatch):
+    watchdog = WatchdogHandler(Broken(), threshold=60.0)
+    errors = []
+    monkeypatch.setattr(watchdog, "handleError", errors.append)
+    record = _record("hello")
+    watchdog.handle(record)
+    assert errors == [record]
+    assert watchdog._inflight == {}